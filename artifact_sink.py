@@ -0,0 +1,87 @@
+"""
+artifact_sink
+Destinations for the debug artifacts (banner images sent to the OCR).
+
+No artifact is saved by default. A sink is passed to extract_date_time:
+
+DirectorySink(directory, base_directory)
+                            write the banners as JPEG in a separate directory
+MemorySink()                keep the banners in memory (e.g. for inspection in a notebook)
+SampledSink(sink, every)    forward one banner every `every` banners to sink
+"""
+
+import hashlib
+import os
+import threading
+from pathlib import Path
+
+
+class DirectorySink:
+    """
+    write the banners in directory (FILE-NAME.jpeg)
+    the subdirectories of base_directory are reproduced in directory, so the
+    files with the same name in different subdirectories (-r) are kept apart;
+    the name of a file outside base_directory is prefixed with a hash of its
+    directory
+    """
+
+    def __init__(self, directory, base_directory=None):
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.base_directory = (
+            Path(os.path.abspath(base_directory))
+            if base_directory is not None
+            else None
+        )
+
+    def artifact_path(self, file_path) -> Path:
+        """
+        returns the path of the banner of file_path
+        """
+        file_path = Path(os.path.abspath(file_path))
+        if self.base_directory is not None and file_path.is_relative_to(
+            self.base_directory
+        ):
+            relative_path = file_path.relative_to(self.base_directory)
+        else:
+            digest = hashlib.md5(str(file_path.parent).encode()).hexdigest()[:8]
+            relative_path = Path(f"{digest}_{file_path.name}")
+        return self.directory / f"{relative_path}.jpeg"
+
+    def save(self, file_path, roi) -> None:
+        import cv2
+
+        path = self.artifact_path(file_path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        cv2.imwrite(str(path), roi)
+
+
+class MemorySink:
+    """
+    keep the banners in memory (file path -> image)
+    """
+
+    def __init__(self):
+        self.artifacts: dict[str, object] = {}
+
+    def save(self, file_path, roi) -> None:
+        self.artifacts[str(file_path)] = roi.copy()
+
+
+class SampledSink:
+    """
+    forward one banner every `every` banners to sink
+    """
+
+    def __init__(self, sink, every: int = 100):
+        self.sink = sink
+        self.every = max(every, 1)
+        self._count = 0
+        self._lock = threading.Lock()
+
+    def save(self, file_path, roi) -> None:
+        with self._lock:
+            forward = self._count % self.every == 0
+            self._count += 1
+        if forward:
+            self.sink.save(file_path, roi)
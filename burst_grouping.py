@@ -0,0 +1,221 @@
+"""
+burst_grouping
+Group the files of a trigger event (burst) to run the OCR once per event.
+
+A camera trap fires bursts: consecutive pictures/clips of the same directory
+(same name prefix, consecutive numbers) taken within a few seconds.
+Only the first and the last file of a burst are read with OCR:
+
+- if the first and the last file have the same date and time, all the files of
+  the burst have the same date and time;
+- otherwise the time field of each file in between (box of the time read by
+  the OCR in the first and the last file) is compared with the time fields of
+  the first and the last file (binarized difference): a file identical to one
+  end and different from the other gets the same result, the other files are
+  read with OCR.
+
+The bursts are decoded as soon as they end: the files must be yielded in name
+order.
+"""
+
+import os
+import re
+from pathlib import Path
+
+# maximum fraction of the pixels of a character changed between two time
+# fields with the same text (compression noise)
+MAX_CHANGED_FRACTION = 0.1
+
+SEQUENCE_PATTERN = re.compile(r"^(.*?)(\d+)$")
+
+
+def sequence_key(file_path: Path) -> tuple[str, int, str]:
+    """
+    returns (prefix, number, suffix) of the file name (IMG_0012.JPG -> ("IMG_", 12, ".jpg"))
+    """
+    match = SEQUENCE_PATTERN.match(file_path.stem)
+    if match is None:
+        return (file_path.stem, -1, file_path.suffix.lower())
+    return (match.group(1), int(match.group(2)), file_path.suffix.lower())
+
+
+def file_mtime(file_path) -> float | None:
+    """
+    returns the modification time of the file (None if not available)
+    """
+    try:
+        return os.stat(file_path).st_mtime
+    except OSError:
+        return None
+
+
+def same_burst(previous: tuple, current: tuple, max_gap: float = 10) -> bool:
+    """
+    returns True if the file current follows the file previous in a burst
+    (same prefix and suffix, next number, modification times within max_gap)
+
+    Args:
+        previous, current (tuple): (sequence key, modification time) of the files
+    """
+    (key, mtime), (previous_key, previous_mtime) = current, previous
+    return (
+        key[1] >= 0
+        and key[0] == previous_key[0]
+        and key[2] == previous_key[2]
+        and key[1] == previous_key[1] + 1
+        and mtime is not None
+        and previous_mtime is not None
+        and abs(mtime - previous_mtime) <= max_gap
+    )
+
+
+def binarize(roi):
+    """
+    returns the binarized banner (Otsu threshold)
+    """
+    import cv2
+
+    _, binary = cv2.threshold(roi, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)
+    return binary
+
+
+def time_field(banner, box, margin: int = 2):
+    """
+    returns the binarized time field of the banner (None if not available)
+
+    Args:
+        banner: grayscale banner
+        box (tuple): left, top, width, height of the time in the banner
+                     (word box of the OCR, see camtrap_banner_decoder.extract_date_time)
+    """
+    if banner is None or not box:
+        return None
+    left, top, width, height = box
+    banner_height, banner_width = banner.shape[:2]
+    field = banner[
+        max(top - margin, 0) : min(top + height + margin, banner_height),
+        max(left - margin, 0) : min(left + width + margin, banner_width),
+    ]
+    if field.size == 0:
+        return None
+    return binarize(field)
+
+
+def max_changed_pixels(box) -> int:
+    """
+    returns the maximum number of changed pixels between two time fields with the
+    same text: a fraction (MAX_CHANGED_FRACTION) of the area of one character
+    (the time HH:MM:SS has 8 characters)
+    """
+    _, _, width, height = box
+    return int(width * height / 8 * MAX_CHANGED_FRACTION)
+
+
+def same_field(binary1, binary2, max_changed: int) -> bool:
+    """
+    returns True if the two binarized time fields contain the same text
+    """
+    import cv2
+
+    if binary1 is None or binary2 is None or binary1.shape != binary2.shape:
+        return False
+    return cv2.countNonZero(cv2.absdiff(binary1, binary2)) <= max_changed
+
+
+def decode_burst(burst: list[Path], decode, read_banner, debug=False):
+    """
+    yield (file path, data) for the files of the burst
+
+    Args:
+        burst (list): files of the burst
+        decode (function): returns the data extracted with OCR from a file
+                           (with the box of the time, "time_box")
+        read_banner (function): returns the grayscale banner of a file (no OCR)
+    """
+    first_data = decode(burst[0])
+    yield burst[0], first_data
+    if len(burst) == 1:
+        return
+
+    last_data = decode(burst[-1])
+    middle = burst[1:-1]
+
+    if "error" not in first_data and "error" not in last_data:
+        if (first_data["date"], first_data["time"]) == (
+            last_data["date"],
+            last_data["time"],
+        ):
+            if debug and middle:
+                print(f"burst of {len(burst)} files with the same date and time")
+            for file_path in middle:
+                yield file_path, dict(first_data)
+            yield burst[-1], last_data
+            return
+
+    # the time field of a file in between must be identical to the time field
+    # of one end and different from the other end, otherwise the file is read with OCR
+    first_box = first_data.get("time_box") if "error" not in first_data else None
+    last_box = last_data.get("time_box") if "error" not in last_data else None
+    first_field = (
+        time_field(read_banner(burst[0]), first_box) if first_box and middle else None
+    )
+    last_field = (
+        time_field(read_banner(burst[-1]), last_box) if last_box and middle else None
+    )
+    for file_path in middle:
+        banner = (
+            read_banner(file_path)
+            if first_field is not None or last_field is not None
+            else None
+        )
+        as_first = first_field is not None and same_field(
+            time_field(banner, first_box), first_field, max_changed_pixels(first_box)
+        )
+        as_last = last_field is not None and same_field(
+            time_field(banner, last_box), last_field, max_changed_pixels(last_box)
+        )
+        if as_first and not as_last:
+            yield file_path, dict(first_data)
+        elif as_last and not as_first:
+            yield file_path, dict(last_data)
+        else:
+            yield file_path, decode(file_path)
+    yield burst[-1], last_data
+
+
+def decode_files(items, decode, read_banner, max_gap: float = 10, debug=False):
+    """
+    yield (file path, data, decoded) for items (file path, data or None)
+    the consecutive files without data are grouped in bursts and decoded when
+    the burst ends (the files must be yielded in name order, see iter_media_files)
+    decoded is True if the data were extracted from the file
+
+    Args:
+        items (iterable): (file path, data) data is None for the files to decode
+        decode (function): returns the data extracted with OCR from a file
+        read_banner (function): returns the grayscale banner of a file (no OCR)
+        max_gap (float): maximum time in seconds between two files of a burst
+    """
+    # files of the current burst with their sequence key and modification time
+    burst = []
+
+    def flush():
+        for file_path, data in decode_burst(
+            [file_path for file_path, _, _ in burst], decode, read_banner, debug
+        ):
+            yield file_path, data, True
+        burst.clear()
+
+    for file_path, data in items:
+        if data is not None:
+            yield file_path, data, False
+            continue
+        key, mtime = sequence_key(file_path), file_mtime(file_path)
+        if burst and not (
+            burst[-1][0].parent == file_path.parent
+            and same_burst(burst[-1][1:], (key, mtime), max_gap)
+        ):
+            yield from flush()
+        burst.append((file_path, key, mtime))
+    if burst:
+        yield from flush()
@@ -47,27 +47,128 @@ https://pyorbital.readthedocs.io/en/feature-moon-phase/moon_calculations.html
 """
 
 import argparse
+import datetime as dt
+import fnmatch
+import os
+import queue
 import re
-import subprocess
 import sys
+import threading
+import time
+from concurrent.futures import as_completed
 from pathlib import Path
 
-import cv2
-import pytesseract
+import artifact_sink
+import burst_grouping
+import exiftool_writer
+import scan_manifest
+import transcoder
 
 __version__ = "0.0.2"
 
 EXTENSIONS = {".avi", ".mp4", ".jpg", ".jpeg"}
 
+# files already re-encoded (in the input directory)
+TRANSCODE_REGISTRY = ".camtrap_transcoded.json"
 
-def banner_text_from_frame(
-    frame, roi_height_fraction: float = 0.15, debug=False, file_path=""
-):
+# name of a renamed file (see get_new_file_path), used without the manifest
+RENAMED_FILE_PATTERN = re.compile(r"^\d{4}-\d{2}-\d{2}_\d{6}_")
+
+# OCR tiers, from the cheapest to the most expensive
+# name: (banner preprocessing (see preprocess_banner), tesseract page segmentation mode,
+#        number of video frames read)
+OCR_TIERS = {
+    "fast": ("gray", 6, 1),
+    "upscale": ("upscale", 6, 1),
+    "threshold": ("threshold", 6, 1),
+    "inverted": ("inverted", 6, 1),
+    "sparse": ("threshold", 11, 1),
+    "frames": ("threshold", 6, 4),
+}
+
+# minimum mean confidence (0-100) of the words of the banner line with date and time
+MIN_CONFIDENCE = 60
+
+# tiers reading only the text rows of the banner (tight crop, see text_rows)
+CROP_TIERS = {"fast"}
+
+
+class TesseractError(Exception):
     """
-    extract text from frame banner
+    tesseract can not be run (not found, wrong path...)
     """
 
-    extracted_text = None
+
+def jpeg_size(image_path) -> tuple[int, int] | None:
+    """
+    returns (width, height) read from the JPEG header (None if not a JPEG file)
+    the image is not decoded
+    """
+    try:
+        with open(image_path, "rb") as f_in:
+            if f_in.read(2) != b"\xff\xd8":
+                return None
+            while True:
+                byte = f_in.read(1)
+                while byte and byte != b"\xff":
+                    byte = f_in.read(1)
+                while byte == b"\xff":
+                    byte = f_in.read(1)
+                if not byte:
+                    return None
+                marker = byte[0]
+                # markers without length
+                if marker == 0x01 or 0xD0 <= marker <= 0xD9:
+                    continue
+                length_bytes = f_in.read(2)
+                if len(length_bytes) != 2:
+                    return None
+                length = int.from_bytes(length_bytes, "big")
+                # start of frame (SOF0-SOF15 except DHT, JPG and DAC)
+                if 0xC0 <= marker <= 0xCF and marker not in (0xC4, 0xC8, 0xCC):
+                    sof = f_in.read(5)
+                    if len(sof) != 5:
+                        return None
+                    height = int.from_bytes(sof[1:3], "big")
+                    width = int.from_bytes(sof[3:5], "big")
+                    return width, height
+                f_in.seek(length - 2, 1)
+    except OSError:
+        return None
+
+
+def load_image(image_path):
+    """
+    load the image at the resolution needed for the OCR of the banner
+
+    the large JPEG pictures (wider than 2592 px) are decoded at 1/2, 1/4 or 1/8
+    of their size (cv2.IMREAD_REDUCED_COLOR_*): the full size array is never
+    allocated and the decoding is faster.
+    returns None if the image can not be loaded
+    """
+    import cv2
+
+    flag = cv2.IMREAD_COLOR
+    size = jpeg_size(image_path)
+    if size is not None and size[0] > 2592:
+        # largest reduction keeping at least 1280 px of width
+        for factor, reduced_flag in (
+            (8, cv2.IMREAD_REDUCED_COLOR_8),
+            (4, cv2.IMREAD_REDUCED_COLOR_4),
+            (2, cv2.IMREAD_REDUCED_COLOR_2),
+        ):
+            if size[0] // factor >= 1280:
+                flag = reduced_flag
+                break
+    return cv2.imread(str(image_path), flag)
+
+
+def banner_roi(frame, roi_height_fraction: float = 0.15, debug=False):
+    """
+    returns the bottom banner of the frame (the frame is resized if wider than 2592 px)
+    """
+    import cv2
+
     # Get frame dimensions
     frame_height, frame_width, _ = frame.shape
 
@@ -86,100 +187,193 @@ def banner_text_from_frame(
 
     # Define the region of interest (ROI)
     roi_height = int(frame_height * roi_height_fraction)
-    roi = frame[frame_height - roi_height : frame_height, 0:frame_width]
-
-    # Save the first sampled frame for inspection
+    return frame[frame_height - roi_height : frame_height, 0:frame_width]
 
-    if file_path:
-        cv2.imwrite(Path(file_path).with_suffix(".jpeg"), roi)
 
-    # Convert ROI to grayscale
-    roi_gray = cv2.cvtColor(roi, cv2.COLOR_BGR2GRAY)
-
-    # Apply OCR to extract text
-    try:
-        extracted_text = pytesseract.image_to_string(roi_gray, config="--psm 6")
-    except Exception:
-        print("Tesseract error")
-        sys.exit()
+def preprocess_banner(roi, method: str = "gray"):
+    """
+    returns the banner prepared for the OCR
 
-    if debug:
-        print(f"{extracted_text=}")
+    Args:
+        roi: banner (BGR)
+        method (str): gray, upscale (x2), threshold (upscale + Otsu threshold)
+                      or inverted (threshold with inverted colors, for the white
+                      text on dark background of the night IR banners)
+    """
+    import cv2
 
-    return extracted_text
+    image = cv2.cvtColor(roi, cv2.COLOR_BGR2GRAY)
+    if method == "gray":
+        return image
+    image = cv2.resize(image, None, fx=2, fy=2, interpolation=cv2.INTER_CUBIC)
+    if method == "upscale":
+        return image
+    _, image = cv2.threshold(image, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)
+    if method == "inverted":
+        image = cv2.bitwise_not(image)
+    return image
 
 
-def extract_banner_text_from_video(
-    video_path, frame_interval=30, roi_height_fraction=0.15, debug=False
-):
+def text_rows(image, margin: int = 4) -> tuple[int, int]:
     """
-    Extracts text from the bottom banner of a video.
-
-    Args:
-        video_path (str): Path to the video file.
-        output_frame_path (str): Path to save a sample frame for inspection.
-        frame_interval (int): Interval at which frames are sampled.
-        roi_height_fraction (float): Fraction of the frame height that contains the banner.
+    returns the first and the last + 1 row of the text of the banner (grayscale)
 
-    Returns:
-        str: Extracted date and time from the video banner.
+    The rows of the banner strip have the color of the bottom row (background)
+    on most of their width: the strip is followed upwards from the bottom row,
+    then the rows with text (pixels far from the background) are kept.
+    All the rows are returned if no text is found.
     """
+    import numpy as np
 
-    extracted_text = None
+    background = int(np.median(image[-1]))
+    far = np.abs(image.astype(np.int16) - background) > 48
+    # pixels of each row different from the background
+    count = far.sum(axis=1)
 
-    # Open the video file
-    video_capture = cv2.VideoCapture(video_path)
+    top = image.shape[0]
+    while top > 0 and count[top - 1] < image.shape[1] / 2:
+        top -= 1
 
-    frame_count = 0
+    text = np.flatnonzero(count[top:] > 1)
+    if len(text) == 0:
+        return 0, image.shape[0]
+    first = max(top + text[0] - margin, 0)
+    last = min(top + text[-1] + 1 + margin, image.shape[0])
+    return first, last
 
-    while True:
-        ret, frame = video_capture.read()
-        if not ret:
-            break
 
-        # Process every `frame_interval` frame
-        if frame_count % frame_interval == 0:
-            extracted_text = banner_text_from_frame(frame, roi_height_fraction, debug)
-            break
+def banner_lines(roi, tier: str = "fast", debug=False) -> list[tuple[str, float, list]]:
+    """
+    OCR of the banner with the method of tier (see OCR_TIERS)
+    returns the lines of text with the mean confidence (0-100) of their words
+    and the list of the words with their box (left, top, width, height in the banner)
+    raise TesseractError if tesseract can not be run
+    """
+    import pytesseract
+
+    method, psm, _ = OCR_TIERS[tier]
+    image = preprocess_banner(roi, method)
+    # the boxes are returned in the coordinates of the banner (not upscaled,
+    # not cropped)
+    scale = image.shape[1] / roi.shape[1]
+    top = 0
+    if tier in CROP_TIERS:
+        top, bottom = text_rows(image)
+        image = image[top:bottom]
+        if debug:
+            print(f"text rows: {top}-{bottom}")
 
-        frame_count += 1
+    try:
+        ocr_data = pytesseract.image_to_data(
+            image, config=f"--psm {psm}", output_type=pytesseract.Output.DICT
+        )
+    except Exception as e:
+        raise TesseractError(str(e)) from e
+
+    # (block, paragraph, line) -> list of (word, confidence, box)
+    words: dict = {}
+    for idx, word in enumerate(ocr_data["text"]):
+        confidence = float(ocr_data["conf"][idx])
+        if not word.strip() or confidence < 0:
+            continue
+        line_key = (
+            ocr_data["block_num"][idx],
+            ocr_data["par_num"][idx],
+            ocr_data["line_num"][idx],
+        )
+        left, box_top, width, height = (
+            round(ocr_data[key][idx] / scale)
+            for key in ("left", "top", "width", "height")
+        )
+        box = (left, box_top + round(top / scale), width, height)
+        words.setdefault(line_key, []).append((word, confidence, box))
+
+    lines = [
+        (
+            " ".join(word for word, _, _ in line_words),
+            sum(confidence for _, confidence, _ in line_words) / len(line_words),
+            [(word, box) for word, _, box in line_words],
+        )
+        for line_words in words.values()
+    ]
 
-    # Release video capture
-    video_capture.release()
+    if debug:
+        print(f"OCR {tier}: {lines=}")
 
-    return extracted_text
+    return lines
 
 
-def extract_banner_text_from_image(image_path, roi_height_fraction=0.15, debug=False):
+def banner_text_from_frame(
+    frame,
+    roi_height_fraction: float = 0.15,
+    debug=False,
+    file_path="",
+    sink=None,
+    tier: str = "fast",
+) -> str:
     """
-    extract text contained in the bottom banner of an image
+    extract text from frame banner
+    the banner is saved in sink (see artifact_sink.py) if not None
     """
-    frame = cv2.imread(image_path)
-    if frame is None:
-        return "Error: Unable to load the image. Check the file path."
+    roi = banner_roi(frame, roi_height_fraction, debug)
 
-    extracted_text = banner_text_from_frame(
-        frame, roi_height_fraction, debug=debug, file_path=image_path
-    )
+    # Save the banner for inspection
+    if sink is not None:
+        sink.save(file_path, roi)
 
-    return extracted_text
+    return "\n".join(line[0] for line in banner_lines(roi, tier, debug))
 
 
-def extract_date_time(path_file, debug=False):
+def read_frames(path_file, count: int = 1) -> list:
     """
-    extract info from the picture/video banner
+    returns the picture (list of one frame) or count frames of the video
+    (the first frame and frames evenly spaced in the video)
+    empty list if the file can not be read
     """
+    import cv2
+
+    if Path(path_file).suffix.lower() in (".jpg", ".jpeg"):
+        frame = load_image(path_file)
+        return [] if frame is None else [frame]
+
+    if Path(path_file).suffix.lower() not in (".avi", ".mp4"):
+        return []
+
+    frames = []
+    video_capture = cv2.VideoCapture(str(path_file))
+    frame_count = int(video_capture.get(cv2.CAP_PROP_FRAME_COUNT))
+    for idx in range(count):
+        if idx:
+            if frame_count <= count:
+                break
+            video_capture.set(cv2.CAP_PROP_POS_FRAMES, idx * frame_count // count)
+        ret, frame = video_capture.read()
+        if not ret:
+            break
+        frames.append(frame)
+    video_capture.release()
 
-    banner_text = None
+    return frames
 
-    if Path(path_file).suffix.lower() in (".avi", ".mp4"):
-        banner_text = extract_banner_text_from_video(path_file, debug=debug)
 
-    if Path(path_file).suffix.lower() in (".jpg", ".jpeg"):
-        banner_text = extract_banner_text_from_image(path_file, debug=debug)
+def read_banner_roi(path_file, roi_height_fraction=0.15):
+    """
+    returns the grayscale banner of the picture (first frame for a video) without OCR
+    None if the file can not be read
+    """
+    frames = read_frames(path_file)
+    if not frames:
+        return None
 
-    if banner_text is None:
-        return {"error": ""}
+    return preprocess_banner(banner_roi(frames[0], roi_height_fraction))
+
+
+def parse_banner_text(banner_text: str, debug=False) -> dict:
+    """
+    extract date, time, temperatures and camera ID from the text of the banner
+    the date and the time must be valid (e.g. 28:41:51 is rejected)
+    returns {"error": ""} if no date and time are found
+    """
 
     patterns = [r"\d{2}-\d{2}-\d{4}", r"\d{2}/\d{2}/\d{4}"]
 
@@ -226,6 +420,14 @@ def extract_date_time(path_file, debug=False):
         else:
             continue
 
+        # misread date or time
+        try:
+            dt.datetime.strptime(f"{date} {hhmmss}", "%Y-%m-%d %H%M%S")
+        except ValueError:
+            if debug:
+                print(f"invalid date/time: {date} {hhmmss}")
+            continue
+
         # Extract temperature in Fahrenheit (e.g., 73F)
         temperature_f = None
         temp_f_match = re.search(r" \d+F ", text)
@@ -284,6 +486,71 @@ def extract_date_time(path_file, debug=False):
     return {"error": ""}
 
 
+def extract_date_time(path_file, debug=False, sink=None, tiers=None):
+    """
+    extract info from the picture/video banner
+    the banner is saved in sink (see artifact_sink.py) if not None
+
+    The OCR tiers (see OCR_TIERS) are tried from the cheapest until a valid
+    date/time is read with a confidence of at least MIN_CONFIDENCE.
+    If no tier reaches MIN_CONFIDENCE the valid result with the highest
+    confidence is returned.
+    The result contains the tier used ("tier"), the mean confidence of
+    the words of the banner line ("confidence") and the box of the time in the
+    banner ("time_box": left, top, width, height, None if not found).
+
+    Args:
+        tiers: names of the OCR tiers to try (default all the tiers)
+
+    raise TesseractError if tesseract can not be run
+    """
+
+    if tiers is None:
+        tiers = tuple(OCR_TIERS)
+
+    # frames read from the file (the first frame is read once for all the tiers)
+    frames = read_frames(path_file)
+    if not frames:
+        return {"error": ""}
+
+    if sink is not None:
+        sink.save(path_file, banner_roi(frames[0]))
+
+    best = {"error": ""}
+    for tier in tiers:
+        frame_count = OCR_TIERS[tier][2]
+        if frame_count > len(frames):
+            frames = read_frames(path_file, frame_count) or frames
+            if len(frames) == 1:
+                # picture or video too short: same frame as the previous tiers
+                continue
+
+        # the tiers reading more frames skip the first frame (already read)
+        for frame in frames[1:frame_count] if frame_count > 1 else frames[:1]:
+            lines = banner_lines(banner_roi(frame, debug=debug), tier, debug)
+            data = parse_banner_text("\n".join(line[0] for line in lines), debug)
+            if "error" in data:
+                continue
+            _, confidence, words = next(
+                line for line in lines if line[0] == data["text"]
+            )
+            data["tier"] = tier
+            data["confidence"] = round(confidence, 1)
+            raw_time = f"{data['time'][0:2]}:{data['time'][2:4]}:{data['time'][4:6]}"
+            data["time_box"] = next(
+                (box for word, box in words if raw_time in word), None
+            )
+            if data["confidence"] >= MIN_CONFIDENCE:
+                return data
+            if "error" in best or data["confidence"] > best["confidence"]:
+                best = data
+
+    if debug and "error" not in best:
+        print(f"low OCR confidence: {best['confidence']}")
+
+    return best
+
+
 def get_new_file_path(args, file_path: Path, data: dict) -> Path:
     """
     returns new file path
@@ -299,6 +566,292 @@ def get_new_file_path(args, file_path: Path, data: dict) -> Path:
     return new_file_path
 
 
+def rename_file(
+    args,
+    file_path: Path,
+    new_file_path: Path,
+    data: dict,
+    metadata_writer=None,
+    manifest=None,
+) -> bool:
+    """
+    rename file (or show the new name) and save date and time into metadata
+    with metadata_writer (ExifToolWriter)
+
+    returns True if the file was renamed
+    """
+    if new_file_path.is_file():
+        print(f"{Path(new_file_path).name} already exists")
+        return False
+
+    if not args.rename:
+        print(f"rename {Path(file_path).name} to {Path(new_file_path).name}")
+        return False
+
+    file_path.rename(new_file_path)
+    print(f"{Path(file_path).name} renamed to {Path(new_file_path).name}")
+    if manifest is not None:
+        manifest.rename(file_path, new_file_path)
+    # save into metadata
+    if metadata_writer is not None:
+        time_exiftool = f"{data['time'][0:2]}:{data['time'][2:4]}:{data['time'][4:6]}"
+        metadata_writer.set_date_time(new_file_path, data["date"], time_exiftool)
+    return True
+
+
+def iter_media_files(directory, pattern="*", recursive=False, sort=False):
+    """
+    yield the media files (EXTENSIONS) of directory matching pattern
+    the files are yielded during the scan (os.scandir)
+
+    Args:
+        directory (str): directory to scan
+        pattern (str): pattern for the file names (fnmatch)
+        recursive (bool): scan the subdirectories (e.g. DCIM/100MEDIA)
+        sort (bool): yield the files in name order (deterministic)
+    """
+    directories = [os.fspath(directory)]
+    while directories:
+        current_dir = directories.pop()
+        try:
+            with os.scandir(current_dir) as it:
+                entries = sorted(it, key=lambda entry: entry.name) if sort else it
+                subdirectories = []
+                for entry in entries:
+                    # skip hidden files (manifest, temporary files)
+                    if entry.name.startswith("."):
+                        continue
+                    if entry.is_dir():
+                        if recursive:
+                            subdirectories.append(entry.path)
+                    elif (
+                        os.path.splitext(entry.name)[1].lower() in EXTENSIONS
+                        and fnmatch.fnmatch(entry.name, pattern)
+                        and entry.is_file()
+                    ):
+                        yield Path(entry.path)
+        except OSError as e:
+            print(f"Error reading directory {current_dir}: {e}")
+            continue
+        # the first subdirectory is scanned next
+        directories.extend(reversed(subdirectories))
+
+
+def prefetch(iterable, maxsize: int = 1000):
+    """
+    yield the items of iterable produced by a background thread
+    at most maxsize items are waiting in the queue
+    """
+    work_queue = queue.Queue(maxsize=maxsize)
+    end = object()
+
+    def producer():
+        try:
+            for item in iterable:
+                work_queue.put(item)
+        finally:
+            work_queue.put(end)
+
+    threading.Thread(target=producer, daemon=True).start()
+    while (item := work_queue.get()) is not end:
+        yield item
+
+
+def already_renamed(file_path: Path) -> bool:
+    """
+    returns True if the name of the file has the format of get_new_file_path
+    (DATE_TIME_...)
+    """
+    return RENAMED_FILE_PATTERN.match(Path(file_path).name) is not None
+
+
+def decoded_files(args, files, manifest, seen: set):
+    """
+    yield (file path, data) for the files to process
+    the data are read from the manifest or extracted from the banner
+    (once per burst with --burst)
+    the files already renamed are skipped (recorded in the manifest, or
+    by name with --no-manifest), all the files are added to seen
+    """
+
+    def items():
+        for file_path in files:
+            seen.add(file_path)
+            # files already renamed (also the files renamed during the scan of
+            # the directory, yielded again by os.scandir) are not decoded
+            if manifest is not None:
+                if manifest.is_done(file_path):
+                    if args.debug:
+                        print(f"{file_path.name} already processed")
+                    continue
+            elif already_renamed(file_path):
+                print(f"{file_path.name} already renamed")
+                continue
+            data = None
+            if manifest is not None and not args.rescan:
+                data = manifest.lookup(file_path)
+                if args.debug and data is not None:
+                    print(f"{file_path.name} result from manifest")
+            yield file_path, data
+
+    def decode(file_path):
+        if args.debug:
+            print(f"{file_path=}")
+        return extract_date_time(
+            str(file_path), debug=args.debug, sink=args.artifact_sink
+        )
+
+    if args.burst:
+        results = burst_grouping.decode_files(
+            items(), decode, read_banner_roi, args.burst_gap, args.debug
+        )
+    else:
+        results = (
+            (
+                (file_path, decode(file_path), True)
+                if data is None
+                else (file_path, data, False)
+            )
+            for file_path, data in items()
+        )
+
+    for file_path, data, decoded in results:
+        if decoded and manifest is not None:
+            manifest.record(file_path, data)
+        yield file_path, data
+
+
+def process_file(
+    args,
+    file_path: Path,
+    data: dict,
+    manifest,
+    transcode_queue,
+    transcodings,
+    metadata_writer,
+) -> None:
+    """
+    rename/re-encode file_path with the date and time extracted from the banner
+    """
+    data = dict(data)
+
+    if "error" in data:
+        print(f"Date and time not found in {file_path}")
+        print("-" * 30)
+        return
+
+    if args.debug:
+        print(f"{data['temperature_c']=}   {data['temperature_f']=}")
+        print(f"OCR tier: {data.get('tier')}  confidence: {data.get('confidence')}")
+
+    if data["date"] and data["time"]:
+        if args.cam_id == "NO":  # , "EXTRACT"):
+            data["cam_id"] = ""
+        elif args.cam_id != "EXTRACT":
+            data["cam_id"] = args.cam_id
+        else:
+            if data["cam_id"] is None:
+                data["cam_id"] = "CAM-ID"
+
+        new_file_path = get_new_file_path(args, file_path, data)
+
+        if (
+            args.reencode
+            and file_path.suffix.lower() in transcoder.TRANSCODE_EXTENSIONS
+        ):
+            print(
+                f"re-encoding {file_path.name} to {file_path.with_suffix('.mp4').name}"
+            )
+            transcodings[transcode_queue.submit(file_path)] = (file_path, data)
+        else:
+            rename_file(args, file_path, new_file_path, data, metadata_writer, manifest)
+    print("-" * 30)
+
+
+def rename_transcoded(
+    args, transcodings: dict, manifest, metadata_writer, wait: bool
+) -> None:
+    """
+    rename the re-encoded files (wait for all the files if wait is True)
+    """
+    if wait:
+        futures = list(as_completed(transcodings))
+    else:
+        futures = [future for future in transcodings if future.done()]
+
+    for future in futures:
+        file_path, data = transcodings.pop(future)
+        try:
+            mp4_file_path = future.result()
+        except Exception as e:
+            print(f"Error re-encoding {file_path.name}: {e}")
+            continue
+        if (
+            rename_file(
+                args,
+                mp4_file_path,
+                get_new_file_path(args, mp4_file_path, data),
+                data,
+                metadata_writer,
+                manifest,
+            )
+            and manifest is not None
+        ):
+            manifest.mark_done(file_path)
+
+
+def watch_directory(
+    args,
+    input_dir,
+    seen: set,
+    manifest,
+    transcode_queue,
+    transcodings,
+    metadata_writer,
+) -> None:
+    """
+    process the new files of input_dir when they are completely copied
+    (same size at two consecutive checks)
+    """
+    # file path -> size at the previous check
+    sizes: dict = {}
+    while True:
+        time.sleep(args.watch_interval)
+        ready = []
+        for file_path in iter_media_files(
+            input_dir, args.pattern, args.recursive, args.sort or args.burst
+        ):
+            if file_path in seen:
+                continue
+            try:
+                size = file_path.stat().st_size
+            except OSError:
+                continue
+            if sizes.get(file_path) != size:
+                # new file or copy in progress
+                sizes[file_path] = size
+                continue
+            del sizes[file_path]
+            ready.append(file_path)
+
+        for file_path, data in decoded_files(args, ready, manifest, seen):
+            process_file(
+                args,
+                file_path,
+                data,
+                manifest,
+                transcode_queue,
+                transcodings,
+                metadata_writer,
+            )
+        rename_transcoded(args, transcodings, manifest, metadata_writer, wait=False)
+        # the grouped metadata are written at each check, not only at the exit
+        if metadata_writer is not None:
+            metadata_writer.flush()
+        if manifest is not None:
+            manifest.save()
+
+
 def parse_arguments():
     """
     parse command line arguments
@@ -333,6 +886,19 @@ def parse_arguments():
         default="*",
         help="Pattern for file selection",
     )
+    parser.add_argument(
+        "-r",
+        "--recursive",
+        action="store_true",
+        dest="recursive",
+        help="Process the files in the subdirectories",
+    )
+    parser.add_argument(
+        "--sort",
+        action="store_true",
+        dest="sort",
+        help="Process the files in name order",
+    )
     parser.add_argument(
         "--cam-id", action="store", dest="cam_id", default="NO", help="CAM_ID default"
     )
@@ -362,6 +928,13 @@ def parse_arguments():
         help="Path for the exiftool executable",
     )
 
+    parser.add_argument(
+        "--group-metadata",
+        action="store_true",
+        dest="group_metadata",
+        help="Save the metadata of files with the same date/time with one exiftool command",
+    )
+
     parser.add_argument(
         "--reencode",
         action="store_true",
@@ -370,6 +943,73 @@ def parse_arguments():
         help="Re-encode files with FFmpeg",
     )
 
+    parser.add_argument(
+        "--reencode-workers",
+        action="store",
+        type=int,
+        dest="reencode_workers",
+        default=2,
+        help="Number of files re-encoded at the same time",
+    )
+
+    parser.add_argument(
+        "--burst",
+        action="store_true",
+        dest="burst",
+        help="Read the banner once per burst (consecutive files taken within --burst-gap seconds, implies --sort)",
+    )
+    parser.add_argument(
+        "--burst-gap",
+        action="store",
+        type=float,
+        dest="burst_gap",
+        default=10,
+        help="Maximum time in seconds between two files of a burst",
+    )
+
+    parser.add_argument(
+        "--no-manifest",
+        action="store_true",
+        dest="no_manifest",
+        help=f"Do not use the manifest of the processed files ({scan_manifest.MANIFEST_FILE_NAME})",
+    )
+    parser.add_argument(
+        "--rescan",
+        action="store_true",
+        dest="rescan",
+        help="Extract date and time again from the files recorded in the manifest",
+    )
+    parser.add_argument(
+        "--watch",
+        action="store_true",
+        dest="watch",
+        help="Process the new files copied in the directory (Ctrl-C to stop)",
+    )
+    parser.add_argument(
+        "--watch-interval",
+        action="store",
+        type=float,
+        dest="watch_interval",
+        default=5,
+        help="Interval in seconds between two checks of the directory in watch mode",
+    )
+
+    parser.add_argument(
+        "--save-banner",
+        action="store",
+        dest="save_banner",
+        default="",
+        help="Directory where the banner images sent to OCR are saved (for inspection)",
+    )
+    parser.add_argument(
+        "--save-banner-every",
+        action="store",
+        type=int,
+        dest="save_banner_every",
+        default=1,
+        help="Save one banner every N files",
+    )
+
     parser.add_argument(
         "--debug", action="store_true", dest="debug", help="Enable debug mode"
     )
@@ -384,12 +1024,15 @@ def parse_arguments():
 def main():
     args = parse_arguments()
 
-    print(f"{args.cam_id=}")
-
     if args.version:
         print(f"camtrap_banner_decoder v. {__version__}\n")
         sys.exit()
 
+    print(f"{args.cam_id=}")
+
+    # OpenCV and pytesseract are loaded only when files are processed
+    import pytesseract
+
     if args.tesseract_cmd:
         if args.tesseract_cmd == "tesseract" or Path(args.tesseract_cmd).is_file():
             pytesseract.pytesseract.tesseract_cmd = args.tesseract_cmd
@@ -408,99 +1051,98 @@ def main():
     if args.debug:
         print(f"{input_dir=}")
 
+    args.artifact_sink = None
+    if args.save_banner:
+        args.artifact_sink = artifact_sink.DirectorySink(args.save_banner, input_dir)
+        if args.save_banner_every > 1:
+            args.artifact_sink = artifact_sink.SampledSink(
+                args.artifact_sink, args.save_banner_every
+            )
+
     if args.output_directory and not Path(args.output_directory).is_dir():
         print(f"Output directory {args.output_directory} not found")
         sys.exit()
 
-    files = sorted(list(Path(input_dir).glob(args.pattern)))
+    files = prefetch(
+        iter_media_files(
+            input_dir, args.pattern, args.recursive, args.sort or args.burst
+        )
+    )
+
+    transcode_queue = None
+    if args.reencode:
+        transcode_queue = transcoder.TranscodeQueue(
+            ffmpeg_path=args.ffmpeg_path,
+            max_workers=args.reencode_workers,
+            registry_path=Path(input_dir) / TRANSCODE_REGISTRY,
+        )
+    metadata_writer = None
+    if args.rename:
+        metadata_writer = exiftool_writer.ExifToolWriter(
+            args.exiftool_path, group_by_timestamp=args.group_metadata
+        )
+        try:
+            metadata_writer.start()
+        except OSError:
+            print(
+                f"The exiftool path {args.exiftool_path} was not found: metadata will not be saved"
+            )
+            metadata_writer = None
+
+    manifest = None if args.no_manifest else scan_manifest.Manifest(input_dir)
+
+    # future -> (file path, extracted data)
+    transcodings: dict = {}
+
+    # files already processed (for the watch mode)
+    seen = set()
+
+    tesseract_error = None
+    try:
+        for file_path, data in decoded_files(args, files, manifest, seen):
+            process_file(
+                args,
+                file_path,
+                data,
+                manifest,
+                transcode_queue,
+                transcodings,
+                metadata_writer,
+            )
+
+        if args.watch:
+            print(f"Watching {input_dir} (Ctrl-C to stop)")
+            try:
+                watch_directory(
+                    args,
+                    input_dir,
+                    seen,
+                    manifest,
+                    transcode_queue,
+                    transcodings,
+                    metadata_writer,
+                )
+            except KeyboardInterrupt:
+                pass
+    except TesseractError as e:
+        # the files already processed are renamed and recorded in the manifest
+        tesseract_error = e
+        print(f"Tesseract error: {e}")
 
-    for file_path in files:
-        if args.debug:
-            print(f"{file_path=}")
+    # rename the re-encoded files as soon as they are ready
+    rename_transcoded(args, transcodings, manifest, metadata_writer, wait=True)
 
-        data = extract_date_time(str(file_path), debug=args.debug)
-        if "error" in data:
-            print(f"Date and time not found in {file_path}")
-            print("-" * 30)
-            continue
+    if transcode_queue is not None:
+        transcode_queue.shutdown()
 
-        if args.debug:
-            print(f"{data['temperature_c']=}   {data['temperature_f']=}")
-
-        if data["date"] and data["time"]:
-            if args.cam_id == "NO":  # , "EXTRACT"):
-                data["cam_id"] = ""
-            elif args.cam_id != "EXTRACT":
-                data["cam_id"] = args.cam_id
-            else:
-                if data["cam_id"] is None:
-                    data["cam_id"] = "CAM-ID"
-
-            new_file_path = get_new_file_path(args, file_path, data)
-
-            # check if file already renamed
-            if str(Path(file_path).name).count("-") == 2:
-                print(f"{Path(file_path).name} already renammed")
-            else:
-                if args.reencode:
-                    if file_path.with_suffix(".mp4").is_file():
-                        print(
-                            f"Error re-encoding: {file_path.with_suffix('.mp4')} already exists"
-                        )
-                    else:
-                        command = f'{args.ffmpeg_path} -i "{file_path}" "{file_path.with_suffix(".mp4")}"'
-                        print(
-                            f"re-encoding {file_path.name} to {file_path.with_suffix('.mp4').name}"
-                        )
-                        p = subprocess.Popen(
-                            command,
-                            stdout=subprocess.PIPE,
-                            stderr=subprocess.PIPE,
-                            shell=True,
-                        )
-                        out, error = p.communicate()
-
-                        file_path = file_path.with_suffix(".mp4")
-
-                        new_file_path = get_new_file_path(args, file_path, data)
-
-                if args.rename:
-                    if new_file_path.is_file():
-                        print(f"{Path(new_file_path).name} already exists")
-                    else:
-                        file_path.rename(new_file_path)
-                        print(
-                            f"{Path(file_path).name} renamed to {Path(new_file_path).name}"
-                        )
-                        # save into metadata
-                        time_exiftool = f"{data['time'][0:2]}:{data['time'][2:4]}:{data['time'][4:6]}"
-                        command = (
-                            f"{args.exiftool_path} "
-                            f'-DateTimeOriginal="{data["date"]} {time_exiftool}" '
-                            f'-CreateDate="{data["date"]} {time_exiftool}" '
-                            f'-ModifyDate="{data["date"]} {time_exiftool}" '
-                            f'-MediaCreateDate="{data["date"]} {time_exiftool}" '
-                            f'-MediaModifyDate="{data["date"]} {time_exiftool}" '
-                            f'-TrackCreateDate="{data["date"]} {time_exiftool}" '
-                            f'-TrackModifyDate="{data["date"]} {time_exiftool}" '
-                            f"-overwrite_original {new_file_path}"
-                        )
-
-                        p = subprocess.Popen(
-                            command,
-                            stdout=subprocess.PIPE,
-                            stderr=subprocess.PIPE,
-                            shell=True,
-                        )
-                        out, error = p.communicate()
-                else:
-                    if new_file_path.is_file():
-                        print(f"{Path(new_file_path).name} already exists")
-                    else:
-                        print(
-                            f"rename {Path(file_path).name} to {Path(new_file_path).name}"
-                        )
-        print("-" * 30)
+    if metadata_writer is not None:
+        metadata_writer.close()
+
+    if manifest is not None:
+        manifest.save()
+
+    if tesseract_error is not None:
+        sys.exit(1)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,303 @@
+"""
+camtrap_import
+Bulk import of camera traps (fototrappole) from a CSV or GeoJSON file.
+
+The rows are validated in a single pass, the valid rows are written in a
+temporary CSV file loaded with COPY in a staging table, then inserted/updated in
+fototrappole with a single INSERT ... ON CONFLICT statement.
+A camera trap belonging to another operator is not modified.
+
+CSV: one row per camera trap with the FIELDS columns (header required)
+GeoJSON: FeatureCollection of Point features, the FIELDS in the properties
+(latitudine, longitudine and altitudine are taken from the coordinates);
+the features are parsed one at a time, the file is not loaded in memory
+
+Require the unique index in sql/fototrappole_import.sql
+"""
+
+import csv
+import datetime as dt
+import io
+import json
+import tempfile
+
+FIELDS = (
+    "codice",
+    "tipo",
+    "data_inizio",
+    "data_fine",
+    "nome",
+    "cognome",
+    "regione",
+    "provincia",
+    "comune",
+    "country",
+    "latitudine",
+    "longitudine",
+    "altitudine",
+    "intersezioni",
+)
+
+REQUIRED_FIELDS = ("codice", "tipo", "data_inizio", "latitudine", "longitudine")
+
+
+def iter_csv_rows(stream):
+    """
+    yield the rows of the CSV file (dict)
+    """
+    text_stream = io.TextIOWrapper(stream, encoding="utf-8-sig", newline="")
+    sample = text_stream.read(4096)
+    text_stream.seek(0)
+    try:
+        dialect = csv.Sniffer().sniff(sample, delimiters=",;\t")
+    except csv.Error:
+        dialect = csv.excel
+    yield from csv.DictReader(text_stream, dialect=dialect)
+
+
+class JSONStream:
+    """
+    incremental reader of the JSON values of a text stream
+    (the stream is read in chunks of chunk_size characters)
+    """
+
+    def __init__(self, text_stream, chunk_size: int = 64 * 1024):
+        self.text_stream = text_stream
+        self.chunk_size = chunk_size
+        self.decoder = json.JSONDecoder()
+        self.buffer = ""
+        self.pos = 0
+        self.eof = False
+
+    def _read(self) -> bool:
+        """
+        add a chunk to the buffer, returns False at the end of the stream
+        """
+        if self.eof:
+            return False
+        chunk = self.text_stream.read(self.chunk_size)
+        if not chunk:
+            self.eof = True
+            return False
+        self.buffer = self.buffer[self.pos :] + chunk
+        self.pos = 0
+        return True
+
+    def peek(self) -> str:
+        """
+        returns the next non-whitespace character ("" at the end of the stream)
+        """
+        while True:
+            while self.pos < len(self.buffer) and self.buffer[self.pos].isspace():
+                self.pos += 1
+            if self.pos < len(self.buffer) or not self._read():
+                return self.buffer[self.pos : self.pos + 1]
+
+    def expect(self, char: str) -> None:
+        """
+        consume char (raise ValueError if the next character is different)
+        """
+        if self.peek() != char:
+            raise ValueError(f"'{char}' atteso nel file JSON")
+        self.pos += 1
+
+    def value(self):
+        """
+        returns the next JSON value
+        """
+        self.peek()
+        while True:
+            try:
+                value, end = self.decoder.raw_decode(self.buffer, self.pos)
+            except json.JSONDecodeError:
+                if not self._read():
+                    raise
+                continue
+            # a number at the end of the buffer may continue in the next chunk
+            if end < len(self.buffer) or not self._read():
+                break
+        self.pos = end
+        return value
+
+
+def iter_geojson_features(stream):
+    """
+    yield the features of the GeoJSON FeatureCollection one at a time
+    (the file is not loaded in memory)
+    """
+    reader = JSONStream(io.TextIOWrapper(stream, encoding="utf-8-sig"))
+    reader.expect("{")
+    if reader.peek() == "}":
+        return
+    while True:
+        key = reader.value()
+        if not isinstance(key, str):
+            raise ValueError("chiave non valida nel file JSON")
+        reader.expect(":")
+        if key == "features":
+            reader.expect("[")
+            if reader.peek() == "]":
+                return
+            while True:
+                yield reader.value()
+                if reader.peek() == "]":
+                    return
+                reader.expect(",")
+        reader.value()
+        if reader.peek() == "}":
+            return
+        reader.expect(",")
+
+
+def iter_geojson_rows(stream):
+    """
+    yield the features of the GeoJSON file as rows (dict)
+    """
+    for feature in iter_geojson_features(stream):
+        if not isinstance(feature, dict):
+            raise ValueError("feature non valida nel file GeoJSON")
+        row = dict(feature.get("properties") or {})
+        geometry = feature.get("geometry") or {}
+        if geometry.get("type") == "Point":
+            coordinates = geometry.get("coordinates", [])
+            if len(coordinates) >= 2:
+                row["longitudine"], row["latitudine"] = coordinates[0], coordinates[1]
+            if len(coordinates) >= 3:
+                row["altitudine"] = coordinates[2]
+        yield row
+
+
+def validate_row(row: dict) -> tuple[dict, list[str]]:
+    """
+    returns the values for the database and the list of errors of the row
+    """
+    values = {}
+    errors = []
+    for field in FIELDS:
+        value = row.get(field)
+        if isinstance(value, str):
+            value = value.strip()
+        values[field] = value if value not in ("", None) else None
+
+    for field in REQUIRED_FIELDS:
+        if values[field] is None:
+            errors.append(f"{field} obbligatorio")
+
+    for field in ("data_inizio", "data_fine"):
+        if values[field] is not None:
+            try:
+                values[field] = dt.date.fromisoformat(str(values[field]))
+            except ValueError:
+                errors.append(f"{field} non valida (AAAA-MM-GG): {values[field]}")
+                values[field] = None
+    if (
+        values["data_inizio"] is not None
+        and values["data_fine"] is not None
+        and values["data_fine"] < values["data_inizio"]
+    ):
+        errors.append("data_fine precedente a data_inizio")
+
+    for field, limit in (
+        ("latitudine", 90),
+        ("longitudine", 180),
+        ("altitudine", None),
+    ):
+        if values[field] is not None:
+            try:
+                values[field] = float(str(values[field]).replace(",", "."))
+            except ValueError:
+                errors.append(f"{field} non è un numero: {values[field]}")
+                continue
+            if limit is not None and not -limit <= values[field] <= limit:
+                errors.append(f"{field} fuori intervallo: {values[field]}")
+
+    if values["country"] is None:
+        values["country"] = "Italia"
+
+    return values, errors
+
+
+def import_fototrappole(engine, stream, file_name: str, operator: str):
+    """
+    import the camera traps of the file in fototrappole
+
+    Args:
+        engine: SQLAlchemy engine (PostgreSQL)
+        stream: binary stream of the file
+        file_name (str): name of the file (.csv or .geojson/.json)
+        operator (str): operator owning the camera traps
+
+    Returns:
+        tuple: number of imported camera traps, list of (row number, codice, error)
+    """
+    if file_name.lower().endswith((".geojson", ".json")):
+        rows = iter_geojson_rows(stream)
+    else:
+        rows = iter_csv_rows(stream)
+
+    report = []
+    codici = set()
+    # valid rows, in CSV format for COPY
+    with tempfile.SpooledTemporaryFile(
+        max_size=10_000_000, mode="w+", newline=""
+    ) as f_csv:
+        writer = csv.writer(f_csv)
+        try:
+            for row_number, row in enumerate(rows, start=1):
+                values, errors = validate_row(row)
+                if values["codice"] in codici:
+                    errors.append("codice ripetuto nel file")
+                if errors:
+                    report.extend(
+                        (row_number, values["codice"], error) for error in errors
+                    )
+                    continue
+                codici.add(values["codice"])
+                writer.writerow(
+                    [
+                        values[field] if values[field] is not None else ""
+                        for field in FIELDS
+                    ]
+                    + [operator]
+                )
+        except (ValueError, UnicodeDecodeError, csv.Error) as e:
+            report.append((0, None, f"File non leggibile: {e}"))
+            return 0, report
+
+        if not codici:
+            return 0, report
+
+        f_csv.seek(0)
+        columns = ", ".join(FIELDS + ("operator",))
+        update = ", ".join(f"{field} = EXCLUDED.{field}" for field in FIELDS[1:])
+
+        connection = engine.raw_connection()
+        try:
+            cursor = connection.cursor()
+            cursor.execute(
+                "CREATE TEMP TABLE fototrappole_staging "
+                "(LIKE fototrappole INCLUDING DEFAULTS) ON COMMIT DROP"
+            )
+            cursor.copy_expert(
+                f"COPY fototrappole_staging ({columns}) FROM STDIN WITH (FORMAT csv)",
+                f_csv,
+            )
+            cursor.execute(
+                f"INSERT INTO fototrappole ({columns}) "
+                f"SELECT {columns} FROM fototrappole_staging "
+                f"ON CONFLICT (codice) DO UPDATE SET {update} "
+                "WHERE fototrappole.operator = EXCLUDED.operator "
+                "RETURNING codice"
+            )
+            imported = {row[0] for row in cursor.fetchall()}
+            connection.commit()
+        except Exception:
+            connection.rollback()
+            raise
+        finally:
+            connection.close()
+
+    for codice in sorted(codici - imported):
+        report.append((None, codice, "codice già presente per un altro operatore"))
+
+    return len(imported), report
@@ -0,0 +1,138 @@
+"""
+exiftool_writer
+Write the date and time metadata with a single exiftool process.
+
+exiftool is started once with -stay_open and the commands are sent on its
+standard input: the Perl startup is paid once and not for every file.
+Files sharing the same timestamp can be grouped in a single command.
+
+Require: exiftool program (see https://exiftool.org)
+"""
+
+import subprocess
+import threading
+
+DATE_TAGS = (
+    "DateTimeOriginal",
+    "CreateDate",
+    "ModifyDate",
+    "MediaCreateDate",
+    "MediaModifyDate",
+    "TrackCreateDate",
+    "TrackModifyDate",
+)
+
+READY = "{ready}"
+
+
+class ExifToolWriter:
+    """
+    exiftool process kept open (-stay_open True -@ -)
+    use one writer per worker thread/process
+    """
+
+    def __init__(self, exiftool_path="exiftool", group_by_timestamp: bool = False):
+        """
+        Args:
+            exiftool_path (str): path of the exiftool executable
+            group_by_timestamp (bool): write the files sharing a timestamp with one command at flush
+        """
+        self.exiftool_path = exiftool_path
+        self.group_by_timestamp = group_by_timestamp
+        self._process = None
+        self._lock = threading.Lock()
+        # (date, time) -> list of file paths
+        self._groups: dict[tuple[str, str], list[str]] = {}
+
+    def start(self) -> None:
+        """
+        start the exiftool process (FileNotFoundError if exiftool is not found)
+        """
+        if self._process is not None:
+            return
+        self._process = subprocess.Popen(
+            [
+                self.exiftool_path,
+                "-stay_open",
+                "True",
+                "-@",
+                "-",
+                "-common_args",
+                "-charset",
+                "filename=utf8",
+                "-overwrite_original",
+            ],
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT,
+            encoding="utf-8",
+        )
+
+    def execute(self, *args: str) -> str:
+        """
+        send a command to exiftool and returns its output
+        """
+        with self._lock:
+            self.start()
+            for arg in args:
+                self._process.stdin.write(f"{arg}\n")
+            self._process.stdin.write("-execute\n")
+            self._process.stdin.flush()
+
+            output = []
+            for line in self._process.stdout:
+                if line.strip() == READY:
+                    break
+                output.append(line)
+            else:
+                raise RuntimeError("exiftool terminated unexpectedly")
+            return "".join(output)
+
+    def set_date_time(self, file_path, date: str, time_: str) -> str:
+        """
+        set the date tags of file_path
+        date is YYYY-MM-DD and time_ is hh:mm:ss
+
+        returns the exiftool output ("" when the file is grouped)
+        """
+        if self.group_by_timestamp:
+            self._groups.setdefault((date, time_), []).append(str(file_path))
+            return ""
+        return self._write((date, time_), [str(file_path)])
+
+    def _write(self, timestamp: tuple[str, str], file_paths: list[str]) -> str:
+        date, time_ = timestamp
+        return self.execute(
+            *(f"-{tag}={date} {time_}" for tag in DATE_TAGS), *file_paths
+        )
+
+    def flush(self) -> str:
+        """
+        write the grouped files (one command for each timestamp)
+        """
+        output = []
+        while self._groups:
+            timestamp, file_paths = self._groups.popitem()
+            output.append(self._write(timestamp, file_paths))
+        return "".join(output)
+
+    def close(self) -> None:
+        """
+        write the grouped files and stop exiftool
+        """
+        try:
+            self.flush()
+        finally:
+            if self._process is not None:
+                with self._lock:
+                    self._process.stdin.write("-stay_open\nFalse\n")
+                    self._process.stdin.flush()
+                    self._process.communicate()
+                    self._process = None
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
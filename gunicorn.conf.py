@@ -0,0 +1,61 @@
+"""
+gunicorn configuration (production server)
+
+gunicorn -c gunicorn.conf.py
+
+Each worker imports the application (no preload_app) and opens its first
+database connection before accepting requests (post_worker_init). The OCR and
+the conversions of the videos to MP4 run in
+ocr_service.py, started separately (the state of the conversions is shared by
+all the workers and the ffmpeg processes survive the restart of a worker):
+
+python ocr_service.py --workers 4 --transcode-workers 2
+
+Reload the code without dropping requests: kill -HUP <master pid>
+(the master starts new workers, which import the new code, and stops the old
+workers after their requests; a change of gunicorn.conf.py is also read)
+
+Environment:
+GUNICORN_BIND     address (default 127.0.0.1:5000, behind nginx)
+GUNICORN_WORKERS  number of worker processes (default 2 x CPU + 1)
+GUNICORN_THREADS  threads for each worker (default 4)
+"""
+
+import multiprocessing
+import os
+
+wsgi_app = "video_upload:app"
+
+bind = os.environ.get("GUNICORN_BIND", "127.0.0.1:5000")
+
+workers = int(os.environ.get("GUNICORN_WORKERS", multiprocessing.cpu_count() * 2 + 1))
+# threads: the requests wait mostly for the database, the uploads and the OCR service
+worker_class = "gthread"
+threads = int(os.environ.get("GUNICORN_THREADS", 4))
+
+# uploads of large videos (higher than ocr_service.OCR_TIMEOUT)
+timeout = 300
+graceful_timeout = 60
+keepalive = 5
+
+# restart the workers periodically (memory used by OpenCV)
+max_requests = 1000
+max_requests_jitter = 100
+
+accesslog = "-"
+errorlog = "-"
+
+
+def post_worker_init(worker):
+    """
+    open the first database connection before the worker accepts requests
+    """
+    from sqlalchemy.exc import SQLAlchemyError
+
+    import video_upload
+
+    try:
+        with video_upload.engine.connect():
+            pass
+    except SQLAlchemyError as e:
+        worker.log.warning("Database not available: %s", e)
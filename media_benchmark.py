@@ -0,0 +1,150 @@
+"""
+media_benchmark
+Throughput of the Range requests sent by the <video> previews.
+
+Several threads request random ranges of an uploaded file (as a browser seeking
+in a clip) from the running application and the requests per second, the MB/s
+and the latency percentiles are printed.
+Run it with and without MEDIA_ACCEL to compare the Flask workers with the
+front-end server.
+
+The uploads are served only to logged users: copy the session cookie of the
+browser.
+
+Usage:
+python media_benchmark.py http://localhost:5000/fototrappole/uploads/2025/03/14/olivier/1741950000_olivier.mp4 --cookie "session=..." --threads 16 --requests 2000
+"""
+
+import argparse
+import random
+import statistics
+import threading
+import time
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+# bytes of each range (chunk requested by the browsers when seeking)
+RANGE_SIZE = 1024 * 1024
+
+
+def file_size(url: str, cookie: str) -> int:
+    """
+    returns the size of the file (Content-Range of a 1 byte request)
+    """
+    request = urllib.request.Request(
+        url, headers={"Range": "bytes=0-0", "Cookie": cookie}
+    )
+    with urllib.request.urlopen(request) as response:
+        if response.status != 206:
+            raise SystemExit(f"Range not supported (status {response.status})")
+        return int(response.headers["Content-Range"].rsplit("/", 1)[1])
+
+
+def fetch_range(url: str, cookie: str, size: int, range_size: int) -> tuple[float, int]:
+    """
+    request a random range of the file
+    returns the latency (seconds) and the number of bytes received
+    """
+    start = random.randrange(max(size - range_size, 1))
+    request = urllib.request.Request(
+        url,
+        headers={"Range": f"bytes={start}-{start + range_size - 1}", "Cookie": cookie},
+    )
+    t0 = time.perf_counter()
+    with urllib.request.urlopen(request) as response:
+        n_bytes = len(response.read())
+    return time.perf_counter() - t0, n_bytes
+
+
+def run(url: str, cookie: str, threads: int, n_requests: int, range_size: int) -> dict:
+    """
+    send n_requests Range requests from threads threads
+    returns the report (requests/s, MB/s, latency percentiles in ms, errors)
+    """
+    size = file_size(url, cookie)
+    latencies = []
+    errors = 0
+    received = 0
+    lock = threading.Lock()
+
+    def worker(_):
+        nonlocal errors, received
+        try:
+            latency, n_bytes = fetch_range(url, cookie, size, range_size)
+        except OSError:
+            with lock:
+                errors += 1
+            return
+        with lock:
+            latencies.append(latency)
+            received += n_bytes
+
+    t0 = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=threads) as executor:
+        list(executor.map(worker, range(n_requests)))
+    elapsed = time.perf_counter() - t0
+
+    report = {
+        "requests/s": len(latencies) / elapsed,
+        "MB/s": received / elapsed / 1024 / 1024,
+        "errors": errors,
+    }
+    if len(latencies) >= 2:
+        percentiles = statistics.quantiles(latencies, n=100)
+        report["p50 ms"] = percentiles[49] * 1000
+        report["p95 ms"] = percentiles[94] * 1000
+        report["p99 ms"] = percentiles[98] * 1000
+    return report
+
+
+def parse_arguments():
+    """
+    parse command line arguments
+    """
+    parser = argparse.ArgumentParser(
+        description="Benchmark of the Range requests of the uploaded videos"
+    )
+    parser.add_argument("url", help="URL of an uploaded file")
+    parser.add_argument(
+        "--cookie",
+        action="store",
+        dest="cookie",
+        default="",
+        help="Cookie header of a logged user (session=...)",
+    )
+    parser.add_argument(
+        "--threads",
+        action="store",
+        type=int,
+        dest="threads",
+        default=8,
+        help="Number of concurrent clients",
+    )
+    parser.add_argument(
+        "--requests",
+        action="store",
+        type=int,
+        dest="n_requests",
+        default=1000,
+        help="Total number of requests",
+    )
+    parser.add_argument(
+        "--range-size",
+        action="store",
+        type=int,
+        dest="range_size",
+        default=RANGE_SIZE,
+        help="Bytes of each range",
+    )
+    return parser.parse_args()
+
+
+def main():
+    args = parse_arguments()
+    report = run(args.url, args.cookie, args.threads, args.n_requests, args.range_size)
+    for key, value in report.items():
+        print(f"{key}: {value:.1f}" if isinstance(value, float) else f"{key}: {value}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,91 @@
+"""
+media_serving
+Serve the uploaded videos to the browser.
+
+Range requests (seeking in the <video> preview), conditional GET (ETag,
+Last-Modified, If-None-Match, If-Range) and wsgi.file_wrapper / sendfile are
+handled by werkzeug's send_file.
+
+When MEDIA_ACCEL is set the Flask worker only checks the authorization and
+returns an empty response with an internal redirect header: the front-end
+server sends the bytes, so multi-GB clips do not keep a Python worker busy.
+
+MEDIA_ACCEL = "x-accel"     nginx (X-Accel-Redirect)
+MEDIA_ACCEL = "x-sendfile"  Apache mod_xsendfile / lighttpd (X-Sendfile)
+
+nginx example (MEDIA_ACCEL_PREFIX = "/protected_uploads/"):
+
+    location /protected_uploads/ {
+        internal;
+        alias /path/to/uploads/;
+    }
+
+"""
+
+import mimetypes
+import os
+from pathlib import Path
+from urllib.parse import quote
+
+from flask import Response, abort, send_file
+from werkzeug.security import safe_join
+
+# the uploaded files are never modified: the browser can reuse them
+MEDIA_MAX_AGE = 3600
+
+ACCEL_MODES = ("", "x-accel", "x-sendfile")
+
+
+def media_path(directory: str, filename: str) -> Path:
+    """
+    returns the path of filename inside directory (404 if not found or outside directory)
+    """
+    path = safe_join(os.fspath(directory), filename)
+    if path is None:
+        abort(404)
+    # absolute path: send_file resolves the relative paths against the
+    # application root, not the working directory
+    path = Path(path).resolve()
+    if not path.is_file():
+        abort(404)
+    return path
+
+
+def send_media(directory: str, filename: str, accel: str = "", accel_prefix: str = ""):
+    """
+    returns the response for the media file
+
+    Args:
+        directory (str): directory containing the media files
+        filename (str): name of the file relative to directory
+        accel (str): "" (Flask sends the bytes), "x-accel" or "x-sendfile"
+        accel_prefix (str): internal location of directory for X-Accel-Redirect
+    """
+
+    if accel not in ACCEL_MODES:
+        raise ValueError(f"Unknown media acceleration mode: {accel}")
+
+    path = media_path(directory, filename)
+
+    if accel:
+        stat = path.stat()
+        mimetype = mimetypes.guess_type(path.name)[0] or "application/octet-stream"
+        response = Response(mimetype=mimetype)
+        if accel == "x-accel":
+            response.headers["X-Accel-Redirect"] = (
+                f"{accel_prefix.rstrip('/')}/{quote(filename)}"
+            )
+        else:
+            response.headers["X-Sendfile"] = str(path)
+        # the front-end server answers Range and conditional requests
+        response.last_modified = stat.st_mtime
+        response.set_etag(f"{stat.st_mtime_ns:x}-{stat.st_size:x}")
+        response.cache_control.private = True
+        response.cache_control.max_age = MEDIA_MAX_AGE
+        return response
+
+    response = send_file(path, conditional=True, etag=True, max_age=MEDIA_MAX_AGE)
+    # the files are served only to logged users
+    response.cache_control.public = False
+    response.cache_control.private = True
+    return response
@@ -0,0 +1,301 @@
+"""
+ocr_service
+Pool of OCR/decoder worker processes and queue of the conversions to MP4
+listening on a local socket.
+
+The web workers send the path of the uploaded file and receive the data
+extracted from the banner (camtrap_banner_decoder.extract_date_time).
+The worker processes are started and warmed (OpenCV, pytesseract and the
+tesseract language data loaded) when the service starts, not during a request.
+
+The AVI videos are converted to MP4 by the queue of the service
+(transcoder.TranscodeQueue): the state of the conversions and the registry of
+the converted files are shared by all the web workers and the ffmpeg processes
+are not stopped when a web worker is restarted.
+
+If the service is not running the web worker decodes (and converts) the file itself.
+
+The web app reads the banner with the cheap OCR tier (FAST_TIERS) and uses the
+expensive tiers (RETRY_TIERS) only if the result is suspect.
+
+Usage:
+python ocr_service.py --workers 4 --transcode-workers 2
+
+Environment:
+OCR_SOCKET   path of the unix socket (default /tmp/camtrap_ocr.sock)
+OCR_AUTHKEY  key shared by the service and the web workers
+"""
+
+import argparse
+import multiprocessing
+import os
+import threading
+from multiprocessing.connection import Client, Listener
+from pathlib import Path
+
+import camtrap_banner_decoder
+import storage
+import transcoder
+
+OCR_SOCKET = os.environ.get("OCR_SOCKET", "/tmp/camtrap_ocr.sock")
+OCR_AUTHKEY = os.environ.get("OCR_AUTHKEY", "camtrap_ocr").encode("utf-8")
+
+# seconds to wait for the result of a file (lower than the gunicorn timeout:
+# the upload of a file can wait for two results, see video_upload.decode_banner)
+OCR_TIMEOUT = 60
+
+# registry of the videos converted to MP4
+TRANSCODE_REGISTRY = Path(storage.UPLOAD_FOLDER) / storage.TRANSCODE_REGISTRY_NAME
+
+# OCR tiers (see camtrap_banner_decoder.OCR_TIERS)
+FAST_TIERS = tuple(camtrap_banner_decoder.OCR_TIERS)[:1]
+RETRY_TIERS = tuple(camtrap_banner_decoder.OCR_TIERS)[1:]
+MIN_CONFIDENCE = camtrap_banner_decoder.MIN_CONFIDENCE
+
+
+def warm_worker():
+    """
+    load the heavy modules and run a first OCR in the worker process
+    """
+    import numpy as np
+
+    frame = np.zeros((200, 640, 3), np.uint8)
+    try:
+        camtrap_banner_decoder.banner_text_from_frame(frame)
+    except Exception as e:
+        print(f"OCR worker warm-up error: {e}")
+
+
+def decode(file_path: str, tiers=None) -> dict:
+    try:
+        return camtrap_banner_decoder.extract_date_time(file_path, tiers=tiers)
+    except camtrap_banner_decoder.TesseractError as e:
+        print(f"Tesseract error: {e}")
+        return {"error": str(e)}
+
+
+def job_state(job: dict | None) -> dict | None:
+    """
+    returns the state of a conversion without the future (not picklable)
+    """
+    if job is None:
+        return None
+    return {key: value for key, value in job.items() if key != "future"}
+
+
+def handle_connection(connection, pool, transcode_queue) -> None:
+    """
+    answer the requests of a web worker:
+    ("ocr", file path, OCR tiers), ("transcode", file path, MD5) or ("progress", file path)
+    """
+    with connection:
+        while True:
+            try:
+                command, file_path, *params = connection.recv()
+            except EOFError:
+                return
+            try:
+                match command:
+                    case "ocr":
+                        result = pool.apply_async(decode, (file_path, *params)).get(
+                            OCR_TIMEOUT
+                        )
+                    case "transcode":
+                        transcode_queue.submit(file_path, content_md5=params[0])
+                        result = job_state(transcode_queue.progress(file_path))
+                    case "progress":
+                        result = job_state(transcode_queue.progress(file_path))
+                    case _:
+                        result = {"error": f"unknown command {command}"}
+            except Exception as e:
+                result = {"error": str(e)}
+            connection.send(result)
+
+
+def serve(
+    workers: int,
+    socket_path: str = OCR_SOCKET,
+    transcode_workers: int = 2,
+    ffmpeg_path: str = "ffmpeg",
+    registry_path=TRANSCODE_REGISTRY,
+) -> None:
+    """
+    start the pool of warm workers and the queue of the conversions to MP4
+    and answer the requests on socket_path
+    """
+    if os.path.exists(socket_path):
+        os.unlink(socket_path)
+
+    transcode_queue = transcoder.TranscodeQueue(
+        ffmpeg_path=ffmpeg_path,
+        max_workers=transcode_workers,
+        registry_path=registry_path,
+    )
+    with multiprocessing.Pool(processes=workers, initializer=warm_worker) as pool:
+        with Listener(socket_path, family="AF_UNIX", authkey=OCR_AUTHKEY) as listener:
+            os.chmod(socket_path, 0o600)
+            print(f"OCR service: {workers} workers listening on {socket_path}")
+            while True:
+                try:
+                    connection = listener.accept()
+                except (OSError, multiprocessing.AuthenticationError) as e:
+                    print(f"OCR service: connection refused ({e})")
+                    continue
+                threading.Thread(
+                    target=handle_connection,
+                    args=(connection, pool, transcode_queue),
+                    daemon=True,
+                ).start()
+
+
+class ServiceUnavailable(Exception):
+    """
+    the OCR service can not be used
+    """
+
+
+# connection of this process to the service (one per thread)
+_local = threading.local()
+
+# queue of the conversions of this process (if the service is not running)
+_transcode_queue = None
+_transcode_queue_lock = threading.Lock()
+
+
+def local_transcode_queue():
+    """
+    returns the queue of the conversions of this process
+    (without registry: the registry is written only by the service)
+    """
+    global _transcode_queue
+    with _transcode_queue_lock:
+        if _transcode_queue is None:
+            _transcode_queue = transcoder.TranscodeQueue(max_workers=1)
+        return _transcode_queue
+
+
+def request(message: tuple):
+    """
+    send the message to the service and returns the answer
+    raise ServiceUnavailable if the service is not running, refuses the
+    connection (wrong OCR_AUTHKEY) or does not answer in time
+    """
+    try:
+        if getattr(_local, "connection", None) is None:
+            _local.connection = Client(
+                OCR_SOCKET, family="AF_UNIX", authkey=OCR_AUTHKEY
+            )
+        _local.connection.send(message)
+        if not _local.connection.poll(OCR_TIMEOUT + 5):
+            raise TimeoutError("no answer from the OCR service")
+        return _local.connection.recv()
+    except (OSError, EOFError, multiprocessing.AuthenticationError) as e:
+        # service not running, restarted or busy: the connection is not reused
+        # (a late answer would be read as the answer of the next request)
+        if getattr(_local, "connection", None) is not None:
+            try:
+                _local.connection.close()
+            except OSError:
+                pass
+        _local.connection = None
+        raise ServiceUnavailable(str(e)) from e
+
+
+def extract_date_time(file_path, tiers=None) -> dict:
+    """
+    returns the data extracted from the banner of file_path by the OCR service
+    with the OCR tiers (default all the tiers)
+    the file is decoded in this process if the service is not running
+    """
+    file_path = os.path.abspath(file_path)
+    try:
+        return request(("ocr", file_path, tiers))
+    except ServiceUnavailable as e:
+        if isinstance(e.__cause__, TimeoutError):
+            return {"error": str(e)}
+        return decode(file_path, tiers)
+
+
+def transcode(file_path, content_md5: str = "") -> dict | None:
+    """
+    add the video to the queue of the conversions to MP4 of the service
+    (of this process if the service is not running)
+    returns the state of the conversion (see transcoder.TranscodeQueue.progress)
+    """
+    file_path = os.path.abspath(file_path)
+    try:
+        return request(("transcode", file_path, content_md5))
+    except ServiceUnavailable:
+        queue = local_transcode_queue()
+        queue.submit(file_path, content_md5=content_md5)
+        return job_state(queue.progress(file_path))
+
+
+def transcode_progress(file_path) -> dict | None:
+    """
+    returns the state of the conversion of the video (None if not submitted)
+    """
+    file_path = os.path.abspath(file_path)
+    try:
+        job = request(("progress", file_path))
+    except ServiceUnavailable:
+        job = None
+    if job is None and _transcode_queue is not None:
+        job = job_state(_transcode_queue.progress(file_path))
+    return job
+
+
+def parse_arguments():
+    """
+    parse command line arguments
+    """
+    parser = argparse.ArgumentParser(description="OCR service for the banner decoder")
+    parser.add_argument(
+        "--workers",
+        action="store",
+        type=int,
+        dest="workers",
+        default=os.cpu_count() or 2,
+        help="Number of OCR worker processes",
+    )
+    parser.add_argument(
+        "--socket",
+        action="store",
+        dest="socket_path",
+        default=OCR_SOCKET,
+        help="Path of the unix socket",
+    )
+    parser.add_argument(
+        "--transcode-workers",
+        action="store",
+        type=int,
+        dest="transcode_workers",
+        default=2,
+        help="Number of videos converted to MP4 at the same time",
+    )
+    parser.add_argument(
+        "--ffmpeg",
+        action="store",
+        dest="ffmpeg_path",
+        default="ffmpeg",
+        help="Path for the ffmpeg executable",
+    )
+    parser.add_argument(
+        "--transcode-registry",
+        action="store",
+        dest="registry_path",
+        default=str(TRANSCODE_REGISTRY),
+        help="Registry of the videos converted to MP4",
+    )
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_arguments()
+    serve(
+        args.workers,
+        args.socket_path,
+        args.transcode_workers,
+        args.ffmpeg_path,
+        args.registry_path,
+    )
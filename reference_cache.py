@@ -0,0 +1,180 @@
+"""
+reference_cache
+Read-through cache of the reference data (fototrappole).
+
+The camera traps change rarely and are read at every htmx request and every
+upload: the rows are kept in memory for TTL seconds.
+Each process (web worker) has its own cache: the version of the reference data
+(sql/reference_version.sql, incremented by a trigger at each change of
+fototrappole) is read at most every VERSION_CHECK_INTERVAL seconds and the
+cache is cleared when it changes.
+save_fototrappola (and the import) call invalidate() after an insert to clear
+the cache of their process at once.
+The unknown camera traps (None) are not cached.
+"""
+
+import threading
+import time
+
+from sqlalchemy import text
+
+TTL = 300
+
+# seconds between two reads of the version of the reference data
+VERSION_CHECK_INTERVAL = 2
+
+
+class TTLCache:
+    """
+    read-through cache with time to live and hit/miss counters
+    None values are not cached
+    """
+
+    def __init__(self, ttl: float = TTL, maxsize: int = 4096):
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        # key -> (expiration time, value)
+        self._data: dict = {}
+        self._lock = threading.Lock()
+
+    def get(self, key, loader):
+        """
+        returns the value of key, loader(key) is called if key is missing or expired
+        """
+        now = time.monotonic()
+        with self._lock:
+            item = self._data.get(key)
+            if item is not None and item[0] > now:
+                self.hits += 1
+                return item[1]
+            self.misses += 1
+
+        value = loader(key)
+        if value is None:
+            return None
+
+        with self._lock:
+            if len(self._data) >= self.maxsize:
+                # remove the expired items, then the oldest
+                self._data = {k: v for k, v in self._data.items() if v[0] > now}
+                if len(self._data) >= self.maxsize:
+                    self._data.pop(next(iter(self._data)))
+            self._data[key] = (now + self.ttl, value)
+        return value
+
+    def invalidate(self, key=None) -> None:
+        """
+        remove key from the cache (all keys if key is None)
+        """
+        with self._lock:
+            if key is None:
+                self._data.clear()
+            else:
+                self._data.pop(key, None)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"size": len(self._data), "hits": self.hits, "misses": self.misses}
+
+
+# codice -> fototrappola row
+fototrappole_cache = TTLCache()
+# operator -> fototrappole rows of the operator
+operator_cache = TTLCache()
+
+# version of the reference data and time of the last read
+_version = {"value": None, "checked": 0.0}
+_version_lock = threading.Lock()
+
+
+def check_version(engine) -> None:
+    """
+    clear the caches if the reference data were changed (by any process)
+    the version is read at most every VERSION_CHECK_INTERVAL seconds
+    """
+    now = time.monotonic()
+    with _version_lock:
+        if now - _version["checked"] < VERSION_CHECK_INTERVAL:
+            return
+        _version["checked"] = now
+
+    with engine.connect() as conn:
+        version = conn.execute(
+            text("SELECT version FROM reference_version WHERE name = 'fototrappole'")
+        ).scalar()
+
+    with _version_lock:
+        changed = version != _version["value"]
+        _version["value"] = version
+    if changed:
+        fototrappole_cache.invalidate()
+        operator_cache.invalidate()
+
+
+def get_fototrappola(engine, codice: str) -> dict | None:
+    """
+    returns the fototrappola with codice (None if not found)
+    """
+    check_version(engine)
+
+    def load(codice):
+        with engine.connect() as conn:
+            row = (
+                conn.execute(
+                    text("SELECT * FROM fototrappole WHERE codice = :codice"),
+                    {"codice": codice},
+                )
+                .mappings()
+                .fetchone()
+            )
+        return dict(row) if row is not None else None
+
+    return fototrappole_cache.get(codice, load)
+
+
+def get_operator_fototrappole(engine, operator: str) -> list[dict]:
+    """
+    returns the fototrappole of the operator
+    """
+    check_version(engine)
+
+    def load(operator):
+        with engine.connect() as conn:
+            rows = (
+                conn.execute(
+                    text("SELECT * FROM fototrappole WHERE operator = :operator"),
+                    {"operator": operator},
+                )
+                .mappings()
+                .all()
+            )
+        return [dict(row) for row in rows]
+
+    return operator_cache.get(operator, load)
+
+
+def invalidate(codice: str | None = None, operator: str | None = None) -> None:
+    """
+    remove the fototrappola codice and the list of the operator from the cache
+    (everything if codice and operator are None)
+    """
+    if codice is None and operator is None:
+        fototrappole_cache.invalidate()
+        operator_cache.invalidate()
+        return
+    if codice is not None:
+        fototrappole_cache.invalidate(codice)
+    if operator is not None:
+        operator_cache.invalidate(operator)
+
+
+def stats() -> dict:
+    """
+    returns the hit/miss counters of the caches
+    """
+    return {
+        "fototrappole": fototrappole_cache.stats(),
+        "operator_fototrappole": operator_cache.stats(),
+    }
@@ -0,0 +1,143 @@
+"""
+scan_manifest
+Manifest of the media files already processed in a directory.
+
+For each file the manifest records the size, the modification time, the MD5 of
+the content and the result extracted from the banner.
+A file whose size and modification time did not change is not processed again,
+a file whose content did not change (same MD5) reuses the recorded result.
+
+The manifest is saved as JSON in the directory (MANIFEST_FILE_NAME).
+"""
+
+import json
+import os
+from pathlib import Path
+
+from transcoder import file_md5
+
+MANIFEST_FILE_NAME = ".camtrap_manifest.json"
+
+MANIFEST_VERSION = 1
+
+
+class Manifest:
+    """
+    manifest of the processed files of a directory
+    """
+
+    def __init__(self, directory, save_every: int = 100):
+        """
+        Args:
+            directory (str): directory containing the media files and the manifest
+            save_every (int): save the manifest every save_every changes
+        """
+        self.directory = Path(directory)
+        self.path = self.directory / MANIFEST_FILE_NAME
+        self.save_every = save_every
+        self._changes = 0
+        # relative path -> {"size", "mtime_ns", "md5", "result", "done"}
+        self.entries: dict[str, dict] = {}
+        self.load()
+
+    def key(self, file_path) -> str | None:
+        """
+        returns the key of file_path (None if file_path is not in the directory)
+        """
+        try:
+            return Path(file_path).relative_to(self.directory).as_posix()
+        except ValueError:
+            return None
+
+    def load(self) -> None:
+        if not self.path.is_file():
+            return
+        try:
+            content = json.loads(self.path.read_text())
+        except (OSError, ValueError):
+            print(
+                f"The manifest {self.path} is not readable: all files will be processed"
+            )
+            return
+        if content.get("version") == MANIFEST_VERSION:
+            self.entries = content.get("files", {})
+
+    def save(self) -> None:
+        """
+        write the manifest atomically
+        """
+        tmp_path = self.path.with_suffix(".tmp")
+        try:
+            tmp_path.write_text(
+                json.dumps({"version": MANIFEST_VERSION, "files": self.entries})
+            )
+            os.replace(tmp_path, self.path)
+        except OSError as e:
+            print(f"Error saving the manifest {self.path}: {e}")
+        self._changes = 0
+
+    def _changed(self) -> None:
+        self._changes += 1
+        if self._changes >= self.save_every:
+            self.save()
+
+    def is_done(self, file_path) -> bool:
+        """
+        returns True if file_path was renamed (or is the result of a rename)
+        """
+        entry = self.entries.get(self.key(file_path))
+        return entry is not None and entry.get("done", False)
+
+    def mark_done(self, file_path) -> None:
+        """
+        record that file_path does not need to be processed again
+        """
+        key = self.key(file_path)
+        if key in self.entries:
+            self.entries[key]["done"] = True
+            self._changed()
+
+    def lookup(self, file_path, stat: os.stat_result | None = None) -> dict | None:
+        """
+        returns the recorded result for file_path or None if the file is new or changed
+        """
+        entry = self.entries.get(self.key(file_path))
+        if entry is None or "result" not in entry:
+            return None
+        if stat is None:
+            stat = os.stat(file_path)
+        if entry["size"] == stat.st_size and entry["mtime_ns"] == stat.st_mtime_ns:
+            return entry["result"]
+        # modification time changed (file copied again): check the content
+        if entry["size"] == stat.st_size and entry["md5"] == file_md5(file_path):
+            entry["mtime_ns"] = stat.st_mtime_ns
+            self._changed()
+            return entry["result"]
+        return None
+
+    def record(self, file_path, result: dict) -> None:
+        """
+        record the result extracted from file_path
+        """
+        key = self.key(file_path)
+        if key is None:
+            return
+        stat = os.stat(file_path)
+        self.entries[key] = {
+            "size": stat.st_size,
+            "mtime_ns": stat.st_mtime_ns,
+            "md5": file_md5(file_path),
+            "result": result,
+        }
+        self._changed()
+
+    def rename(self, file_path, new_file_path) -> None:
+        """
+        record the rename of file_path to new_file_path
+        """
+        entry = self.entries.pop(self.key(file_path), {})
+        new_key = self.key(new_file_path)
+        if new_key is not None:
+            entry["done"] = True
+            self.entries[new_key] = entry
+        self._changed()
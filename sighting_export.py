@@ -0,0 +1,553 @@
+"""
+sighting_export
+Export of the sightings (sighting + media + fototrappole) in CSV, Parquet or
+Camtrap DP (https://camtrap-dp.tdwg.org) format.
+
+The rows are read with a server-side cursor (stream_results / yield_per) and
+written batch by batch: the memory used does not depend on the number of
+sightings. The thumbnails are not included, they are referenced by the
+media_id key (route /thumbnail/<media_id> or --thumbnails DIRECTORY).
+
+Parquet requires pyarrow (optional dependency: pip install ".[parquet]").
+
+Usage:
+python sighting_export.py -f csv -o sightings.csv
+python sighting_export.py -f parquet -o sightings.parquet
+python sighting_export.py -f camtrapdp -o sightings.zip --thumbnails thumbnails
+"""
+
+import argparse
+import csv
+import datetime as dt
+import decimal
+import io
+import json
+import mimetypes
+import sys
+import zipfile
+from pathlib import Path
+from zoneinfo import ZoneInfo
+
+from sqlalchemy import create_engine, text
+
+DATABASE_URL = "postgresql://sighting_user@localhost:5432/sighting"
+
+BATCH_SIZE = 1000
+
+# time zone of the dates/times of the archive (local time of the camera traps)
+TIMEZONE = ZoneInfo("Europe/Rome")
+
+FORMATS = {
+    "csv": ("text/csv", ".csv"),
+    "parquet": ("application/vnd.apache.parquet", ".parquet"),
+    "camtrapdp": ("application/zip", ".zip"),
+}
+
+PARQUET_REQUIRED = 'The Parquet export requires pyarrow (pip install ".[parquet]")'
+
+# column name, SQL expression, type (for Parquet)
+COLUMNS = (
+    ("sighting_id", "sighting.id", "int"),
+    ("code", "sighting.code", "str"),
+    ("operator", "sighting.operator", "str"),
+    ("institution", "sighting.institution", "str"),
+    ("timestamp", "sighting.timestamp", "str"),
+    ("camtrap_id", "sighting.camtrap_id", "str"),
+    ("scalp", "sighting.scalp", "str"),
+    ("transect_id", "sighting.transect_id", "str"),
+    ("wolf_number", "sighting.wolf_number", "int"),
+    ("latitude", "sighting.latitude", "float"),
+    ("longitude", "sighting.longitude", "float"),
+    ("notes", "sighting.notes", "str"),
+    ("media_id", "media.id", "int"),
+    ("original_file_name", "media.original_file_name", "str"),
+    ("new_file_name", "media.new_file_name", "str"),
+    ("file_content_md5", "media.file_content_md5", "str"),
+    ("camtrap_type", "fototrappole.tipo", "str"),
+    ("region", "fototrappole.regione", "str"),
+    ("province", "fototrappole.provincia", "str"),
+    ("municipality", "fototrappole.comune", "str"),
+    ("country", "fototrappole.country", "str"),
+    ("camtrap_latitude", "fototrappole.latitudine", "float"),
+    ("camtrap_longitude", "fototrappole.longitudine", "float"),
+    ("camtrap_altitude", "fototrappole.altitudine", "float"),
+)
+
+COLUMN_NAMES = [name for name, _, _ in COLUMNS]
+
+EXPORT_QUERY = text(
+    f"SELECT {', '.join(f'{expression} AS {name}' for name, expression, _ in COLUMNS)} "
+    "FROM sighting "
+    "JOIN media ON media.sighting_id = sighting.id "
+    "LEFT JOIN fototrappole ON fototrappole.codice = sighting.camtrap_id "
+    "ORDER BY sighting.id, media.id"
+)
+
+DEPLOYMENTS_QUERY = text(
+    "SELECT codice, comune, latitudine, longitudine, data_inizio, data_fine "
+    "FROM fototrappole ORDER BY codice"
+)
+
+THUMBNAILS_QUERY = text("SELECT id, image FROM media WHERE image IS NOT NULL")
+
+CAMTRAP_DP_PROFILE = (
+    "https://raw.githubusercontent.com/tdwg/camtrap-dp/1.0/camtrap-dp-profile.json"
+)
+CAMTRAP_DP_SCHEMA = (
+    "https://raw.githubusercontent.com/tdwg/camtrap-dp/1.0/{}-table-schema.json"
+)
+
+DEPLOYMENTS_FIELDS = [
+    "deploymentID",
+    "locationID",
+    "locationName",
+    "latitude",
+    "longitude",
+    "deploymentStart",
+    "deploymentEnd",
+]
+MEDIA_FIELDS = [
+    "mediaID",
+    "deploymentID",
+    "captureMethod",
+    "timestamp",
+    "filePath",
+    "filePublic",
+    "fileName",
+    "fileMediatype",
+]
+OBSERVATIONS_FIELDS = [
+    "observationID",
+    "deploymentID",
+    "mediaID",
+    "eventStart",
+    "eventEnd",
+    "observationLevel",
+    "observationType",
+    "scientificName",
+    "count",
+]
+
+
+class ChunkBuffer(io.RawIOBase):
+    """
+    non-seekable file collecting the written bytes until drain() (HTTP streaming)
+    """
+
+    def __init__(self):
+        self._chunks = []
+        self._position = 0
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        self._position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self._position
+
+    def drain(self) -> bytes:
+        data = b"".join(self._chunks)
+        self._chunks.clear()
+        return data
+
+
+def export_value(value):
+    """
+    returns the value for the export (ISO 8601 dates, float for numeric)
+    """
+    if isinstance(value, (dt.date, dt.datetime)):
+        return value.isoformat()
+    if isinstance(value, decimal.Decimal):
+        return float(value)
+    return value
+
+
+def stream_rows(conn, query, params=None):
+    """
+    yield the rows of query in batches of BATCH_SIZE (server-side cursor)
+    """
+    result = conn.execution_options(stream_results=True, yield_per=BATCH_SIZE).execute(
+        query, params or {}
+    )
+    for partition in result.mappings().partitions(BATCH_SIZE):
+        yield [
+            {key: export_value(value) for key, value in row.items()}
+            for row in partition
+        ]
+
+
+def csv_bytes(rows: list[dict], fieldnames, header: bool = False) -> bytes:
+    """
+    returns the rows as CSV (UTF-8)
+    """
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, fieldnames=fieldnames, lineterminator="\n")
+    if header:
+        writer.writeheader()
+    writer.writerows(rows)
+    return buffer.getvalue().encode("utf-8")
+
+
+def write_csv(conn, out):
+    """
+    write the sightings as CSV in out (binary file), yield after each batch
+    """
+    out.write(csv_bytes([], COLUMN_NAMES, header=True))
+    yield
+    for rows in stream_rows(conn, EXPORT_QUERY):
+        out.write(csv_bytes(rows, COLUMN_NAMES))
+        yield
+
+
+def check_format(export_format: str) -> None:
+    """
+    raise RuntimeError if the optional dependency of export_format is missing
+    (call it before starting a streamed response)
+    """
+    if export_format == "parquet":
+        try:
+            import pyarrow.parquet  # noqa: F401
+        except ImportError:
+            raise RuntimeError(PARQUET_REQUIRED)
+
+
+def write_parquet(conn, out):
+    """
+    write the sightings as Parquet in out (binary file), one row group by batch
+    """
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError:
+        raise RuntimeError(PARQUET_REQUIRED)
+
+    types = {"int": pa.int64(), "float": pa.float64(), "str": pa.string()}
+    schema = pa.schema([(name, types[type_]) for name, _, type_ in COLUMNS])
+    converters = {"int": int, "float": float, "str": str}
+
+    writer = pq.ParquetWriter(out, schema)
+    try:
+        for rows in stream_rows(conn, EXPORT_QUERY):
+            for row in rows:
+                for name, _, type_ in COLUMNS:
+                    if row[name] is not None:
+                        row[name] = converters[type_](row[name])
+            writer.write_table(pa.Table.from_pylist(rows, schema=schema))
+            yield
+    finally:
+        writer.close()
+    yield
+
+
+def local_datetime(value: str, time_of_day: str = "00:00:00") -> str:
+    """
+    returns the date/time of the archive (ISO 8601, local time of the camera
+    traps) with the UTC offset, as required by Camtrap DP
+    (e.g. 2024-05-21T20:00:00+02:00)
+    a date is completed with time_of_day
+    """
+    if len(value) == 10:
+        value = f"{value}T{time_of_day}"
+    return (
+        dt.datetime.fromisoformat(value)
+        .replace(tzinfo=TIMEZONE)
+        .isoformat(timespec="seconds")
+    )
+
+
+def camtrap_dp_deployment(row, now: dt.datetime) -> dict | None:
+    """
+    returns the Camtrap DP deployment of the camera trap
+    (None if the required fields are missing)
+    a camera trap without data_fine is still active: deploymentEnd is the
+    time of the export
+    """
+    if None in (row["latitudine"], row["longitudine"], row["data_inizio"]):
+        return None
+    if row["data_fine"] is not None:
+        deployment_end = local_datetime(row["data_fine"], "23:59:59")
+    else:
+        deployment_end = now.isoformat(timespec="seconds")
+    return {
+        "deploymentID": row["codice"],
+        "locationID": row["codice"],
+        "locationName": row["comune"],
+        "latitude": row["latitudine"],
+        "longitude": row["longitudine"],
+        "deploymentStart": local_datetime(row["data_inizio"]),
+        "deploymentEnd": deployment_end,
+    }
+
+
+def camtrap_dp_exported(row, deployments: set) -> bool:
+    """
+    True if the media of the row has the fields required by Camtrap DP
+    (date/time, file, deployment exported)
+    """
+    return (
+        row["timestamp"] is not None
+        and bool(row["new_file_name"])
+        and row["camtrap_id"] in deployments
+        and (mimetypes.guess_type(row["new_file_name"])[0] or "").startswith(
+            ("image/", "video/", "audio/")
+        )
+    )
+
+
+def write_camtrap_dp(conn, out):
+    """
+    write the sightings as a Camtrap DP package (zip) in out (binary file)
+    deployments = fototrappole, media = media, observations = sighting
+    the camera traps and the media without the fields required by Camtrap DP
+    (coordinates, dates, date/time of the sighting) are not exported, their
+    number is reported in the description of the package
+    """
+    now = dt.datetime.now(dt.timezone.utc)
+    temporal = {"start": None, "end": None}
+    # bounding box of the deployments (min lon, min lat, max lon, max lat)
+    bbox = None
+    deployments = set()
+    skipped = {"deployments": 0, "media": 0}
+
+    with zipfile.ZipFile(out, "w", compression=zipfile.ZIP_DEFLATED) as zip_file:
+        with zip_file.open("deployments.csv", "w") as f_out:
+            f_out.write(csv_bytes([], DEPLOYMENTS_FIELDS, header=True))
+            for rows in stream_rows(conn, DEPLOYMENTS_QUERY):
+                batch = []
+                for row in rows:
+                    deployment = camtrap_dp_deployment(row, now)
+                    if deployment is None:
+                        skipped["deployments"] += 1
+                        continue
+                    deployments.add(row["codice"])
+                    longitude, latitude = row["longitudine"], row["latitudine"]
+                    if bbox is None:
+                        bbox = [longitude, latitude, longitude, latitude]
+                    else:
+                        bbox = [
+                            min(bbox[0], longitude),
+                            min(bbox[1], latitude),
+                            max(bbox[2], longitude),
+                            max(bbox[3], latitude),
+                        ]
+                    batch.append(deployment)
+                f_out.write(csv_bytes(batch, DEPLOYMENTS_FIELDS))
+                yield
+
+        with zip_file.open("media.csv", "w") as f_out:
+            f_out.write(csv_bytes([], MEDIA_FIELDS, header=True))
+            for rows in stream_rows(conn, EXPORT_QUERY):
+                media = []
+                for row in rows:
+                    if not camtrap_dp_exported(row, deployments):
+                        skipped["media"] += 1
+                        continue
+                    if (
+                        temporal["start"] is None
+                        or row["timestamp"] < temporal["start"]
+                    ):
+                        temporal["start"] = row["timestamp"]
+                    if temporal["end"] is None or row["timestamp"] > temporal["end"]:
+                        temporal["end"] = row["timestamp"]
+                    media.append(
+                        {
+                            "mediaID": row["media_id"],
+                            "deploymentID": row["camtrap_id"],
+                            "captureMethod": "activityDetection",
+                            "timestamp": local_datetime(row["timestamp"]),
+                            "filePath": row["new_file_name"],
+                            "filePublic": "false",
+                            "fileName": row["original_file_name"],
+                            "fileMediatype": mimetypes.guess_type(row["new_file_name"])[
+                                0
+                            ],
+                        }
+                    )
+                f_out.write(csv_bytes(media, MEDIA_FIELDS))
+                yield
+
+        with zip_file.open("observations.csv", "w") as f_out:
+            f_out.write(csv_bytes([], OBSERVATIONS_FIELDS, header=True))
+            for rows in stream_rows(conn, EXPORT_QUERY):
+                f_out.write(
+                    csv_bytes(
+                        [
+                            {
+                                # a sighting has one observation for each media
+                                "observationID": f"{row['code']}-{row['media_id']}",
+                                "deploymentID": row["camtrap_id"],
+                                "mediaID": row["media_id"],
+                                "eventStart": local_datetime(row["timestamp"]),
+                                "eventEnd": local_datetime(row["timestamp"]),
+                                "observationLevel": "media",
+                                "observationType": "animal",
+                                "scientificName": "Canis lupus",
+                                # count is at least 1 (empty if unknown)
+                                "count": row["wolf_number"] or None,
+                            }
+                            for row in rows
+                            if camtrap_dp_exported(row, deployments)
+                        ],
+                        OBSERVATIONS_FIELDS,
+                    )
+                )
+                yield
+
+        datapackage = {
+            "profile": CAMTRAP_DP_PROFILE,
+            "name": "camera-trap-archive",
+            "created": now.isoformat(timespec="seconds"),
+            "contributors": [{"title": "Archivio fototrappole"}],
+            "project": {
+                "title": "Archivio fototrappole",
+                "samplingDesign": "opportunistic",
+                "captureMethod": ["activityDetection"],
+                "individualAnimals": False,
+                "observationLevel": ["media"],
+            },
+            "taxonomic": [{"scientificName": "Canis lupus"}],
+            "resources": [
+                {
+                    "name": name,
+                    "path": f"{name}.csv",
+                    "profile": "tabular-data-resource",
+                    "format": "csv",
+                    "mediatype": "text/csv",
+                    "encoding": "utf-8",
+                    "schema": CAMTRAP_DP_SCHEMA.format(name),
+                }
+                for name in ("deployments", "media", "observations")
+            ],
+        }
+        if bbox is not None:
+            datapackage["spatial"] = {
+                "type": "Polygon",
+                "bbox": bbox,
+                "coordinates": [
+                    [
+                        [bbox[0], bbox[1]],
+                        [bbox[2], bbox[1]],
+                        [bbox[2], bbox[3]],
+                        [bbox[0], bbox[3]],
+                        [bbox[0], bbox[1]],
+                    ]
+                ],
+            }
+        if temporal["start"] is not None:
+            datapackage["temporal"] = {
+                "start": temporal["start"][:10],
+                "end": temporal["end"][:10],
+            }
+        if skipped["deployments"] or skipped["media"]:
+            datapackage["description"] = (
+                f"Non esportati (campi obbligatori mancanti): "
+                f"{skipped['deployments']} fototrappole, {skipped['media']} media"
+            )
+        zip_file.writestr("datapackage.json", json.dumps(datapackage, indent=2))
+    yield
+
+
+WRITERS = {"csv": write_csv, "parquet": write_parquet, "camtrapdp": write_camtrap_dp}
+
+
+def iter_export(engine, export_format: str):
+    """
+    yield the export in chunks of bytes (for a streamed HTTP response)
+    """
+    buffer = ChunkBuffer()
+    with engine.connect() as conn:
+        for _ in WRITERS[export_format](conn, buffer):
+            if data := buffer.drain():
+                yield data
+    if data := buffer.drain():
+        yield data
+
+
+def export_to_file(engine, export_format: str, file_path) -> None:
+    """
+    write the export in file_path
+    """
+    check_format(export_format)
+    with engine.connect() as conn, open(file_path, "wb") as f_out:
+        for _ in WRITERS[export_format](conn, f_out):
+            pass
+
+
+def export_thumbnails(engine, directory) -> int:
+    """
+    write the thumbnails in directory (MEDIA_ID.jpg), returns the number of files
+    """
+    directory = Path(directory)
+    directory.mkdir(parents=True, exist_ok=True)
+    count = 0
+    with engine.connect() as conn:
+        result = conn.execution_options(
+            stream_results=True, yield_per=BATCH_SIZE
+        ).execute(THUMBNAILS_QUERY)
+        for row in result:
+            (directory / f"{row.id}.jpg").write_bytes(row.image)
+            count += 1
+    return count
+
+
+def parse_arguments():
+    """
+    parse command line arguments
+    """
+    parser = argparse.ArgumentParser(description="Export the sightings")
+    parser.add_argument(
+        "-f",
+        "--format",
+        action="store",
+        dest="format",
+        choices=list(FORMATS),
+        default="csv",
+        help="Export format",
+    )
+    parser.add_argument(
+        "-o",
+        "--output",
+        action="store",
+        dest="output",
+        required=True,
+        help="Output file",
+    )
+    parser.add_argument(
+        "--thumbnails",
+        action="store",
+        dest="thumbnails",
+        default="",
+        help="Directory where the thumbnails are saved (MEDIA_ID.jpg)",
+    )
+    parser.add_argument(
+        "--database",
+        action="store",
+        dest="database_url",
+        default=DATABASE_URL,
+        help="Database URL",
+    )
+    return parser.parse_args()
+
+
+def main():
+    args = parse_arguments()
+    engine = create_engine(args.database_url)
+
+    try:
+        export_to_file(engine, args.format, args.output)
+    except RuntimeError as e:
+        print(e)
+        sys.exit(1)
+    print(f"Sightings exported in {args.output}")
+
+    if args.thumbnails:
+        n_thumbnails = export_thumbnails(engine, args.thumbnails)
+        print(f"{n_thumbnails} thumbnails saved in {args.thumbnails}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,159 @@
+"""
+sighting_search
+Search of the sightings with filters and keyset pagination.
+
+Filters (query string parameters):
+    date_from, date_to      date range (YYYY-MM-DD, date_to included)
+    camtrap_id              code of the camera trap
+    scalp                   SCALP class (C1, C3)
+    wolf_number             number of wolves
+    region, province        region/province of the camera trap (fototrappole)
+    bbox                    min_lon,min_lat,max_lon,max_lat
+    q                       text contained in the notes
+    after                   cursor returned by the previous page
+    limit                   number of sightings per page (max MAX_LIMIT)
+
+The indexes used by the search are in sql/search_indexes.sql
+"""
+
+import datetime as dt
+
+from sqlalchemy import text
+
+DEFAULT_LIMIT = 100
+MAX_LIMIT = 1000
+
+COLUMNS = (
+    "sighting.id, sighting.code, sighting.operator, sighting.institution, "
+    "sighting.timestamp, sighting.camtrap_id, sighting.scalp, sighting.wolf_number, "
+    "sighting.latitude, sighting.longitude, sighting.notes, "
+    "fototrappole.regione, fototrappole.provincia, fototrappole.comune"
+)
+
+
+def parse_filters(args) -> dict:
+    """
+    returns the search parameters from the request arguments
+    raises ValueError for an invalid parameter
+    """
+    filters = {}
+
+    for name in ("date_from", "date_to"):
+        if args.get(name):
+            try:
+                filters[name] = dt.date.fromisoformat(args[name])
+            except ValueError:
+                raise ValueError(f"{name} must be a date (YYYY-MM-DD)")
+    if "date_to" in filters:
+        # date_to is included
+        filters["date_to"] += dt.timedelta(days=1)
+
+    for name in ("camtrap_id", "scalp", "region", "province"):
+        if args.get(name):
+            filters[name] = args[name]
+
+    for name in ("wolf_number", "after"):
+        if args.get(name):
+            try:
+                filters[name] = int(args[name])
+            except ValueError:
+                raise ValueError(f"{name} must be an integer")
+
+    if args.get("bbox"):
+        try:
+            min_lon, min_lat, max_lon, max_lat = (
+                float(x) for x in args["bbox"].split(",")
+            )
+        except ValueError:
+            raise ValueError("bbox must be min_lon,min_lat,max_lon,max_lat")
+        filters.update(
+            {
+                "min_lon": min_lon,
+                "min_lat": min_lat,
+                "max_lon": max_lon,
+                "max_lat": max_lat,
+            }
+        )
+
+    if args.get("q"):
+        # the text is searched with the trigram index
+        escaped = (
+            args["q"].replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+        )
+        filters["q"] = f"%{escaped}%"
+
+    try:
+        limit = int(args.get("limit", DEFAULT_LIMIT))
+    except ValueError:
+        raise ValueError("limit must be an integer")
+    filters["limit"] = min(max(limit, 1), MAX_LIMIT)
+
+    return filters
+
+
+def search_query(filters: dict):
+    """
+    returns the SQL query for the filters (parameters are the filters)
+    one more row than the limit is selected to know if there is a next page
+    """
+    conditions = []
+    if "date_from" in filters:
+        conditions.append("sighting.timestamp >= :date_from")
+    if "date_to" in filters:
+        conditions.append("sighting.timestamp < :date_to")
+    if "camtrap_id" in filters:
+        conditions.append("sighting.camtrap_id = :camtrap_id")
+    if "scalp" in filters:
+        conditions.append("sighting.scalp = :scalp")
+    if "wolf_number" in filters:
+        conditions.append("sighting.wolf_number = :wolf_number")
+    if "region" in filters:
+        conditions.append("fototrappole.regione = :region")
+    if "province" in filters:
+        conditions.append("fototrappole.provincia = :province")
+    if "min_lon" in filters:
+        # same expression as the GiST index sighting_position_idx
+        conditions.append(
+            "point(sighting.longitude::float8, sighting.latitude::float8) "
+            "<@ box(point(:min_lon, :min_lat), point(:max_lon, :max_lat))"
+        )
+    if "q" in filters:
+        conditions.append("sighting.notes ILIKE :q")
+    if "after" in filters:
+        # keyset pagination
+        conditions.append("sighting.id < :after")
+
+    where = f"WHERE {' AND '.join(conditions)} " if conditions else ""
+
+    return text(
+        f"SELECT {COLUMNS} "
+        "FROM sighting LEFT JOIN fototrappole ON fototrappole.codice = sighting.camtrap_id "
+        f"{where}"
+        "ORDER BY sighting.id DESC "
+        "LIMIT :limit_plus_one"
+    )
+
+
+def search_sightings(conn, filters: dict) -> tuple[list[dict], int | None]:
+    """
+    returns the sightings of the page and the cursor of the next page (None if last page)
+    """
+    params = dict(filters, limit_plus_one=filters["limit"] + 1)
+    rows = conn.execute(search_query(filters), params).mappings().all()
+
+    next_cursor = None
+    if len(rows) > filters["limit"]:
+        rows = rows[: filters["limit"]]
+        next_cursor = rows[-1]["id"]
+
+    sightings = []
+    for row in rows:
+        sighting = dict(row)
+        if isinstance(sighting["timestamp"], dt.date):
+            sighting["timestamp"] = sighting["timestamp"].isoformat()
+        for name in ("latitude", "longitude"):
+            if sighting[name] is not None:
+                sighting[name] = float(sighting[name])
+        sightings.append(sighting)
+
+    return sightings, next_cursor
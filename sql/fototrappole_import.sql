@@ -0,0 +1,4 @@
+-- unique camera trap code, required by the bulk import (camtrap_import.py, ON CONFLICT (codice))
+-- psql -d sighting -f sql/fototrappole_import.sql
+
+CREATE UNIQUE INDEX IF NOT EXISTS fototrappole_codice_key ON fototrappole (codice);
@@ -0,0 +1,12 @@
+-- bytes and number of the files uploaded by each operator (storage.py)
+-- and index for the garbage collector of the uploads (media not saved)
+-- psql -d sighting -f sql/operator_storage.sql
+
+CREATE TABLE IF NOT EXISTS operator_storage (
+    operator text PRIMARY KEY,
+    bytes bigint NOT NULL DEFAULT 0,
+    files integer NOT NULL DEFAULT 0,
+    updated_at timestamp NOT NULL DEFAULT now()
+);
+
+CREATE INDEX IF NOT EXISTS media_new_file_name_idx ON media (new_file_name);
@@ -0,0 +1,22 @@
+-- version of the reference data, incremented at each change of fototrappole
+-- (by any process): the web workers clear their cache when it changes (reference_cache.py)
+-- psql -d sighting -f sql/reference_version.sql
+
+CREATE TABLE IF NOT EXISTS reference_version (
+    name text PRIMARY KEY,
+    version bigint NOT NULL DEFAULT 0
+);
+
+INSERT INTO reference_version (name) VALUES ('fototrappole') ON CONFLICT DO NOTHING;
+
+CREATE OR REPLACE FUNCTION fototrappole_version() RETURNS trigger AS $$
+BEGIN
+    UPDATE reference_version SET version = version + 1 WHERE name = 'fototrappole';
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS fototrappole_version_trigger ON fototrappole;
+CREATE TRIGGER fototrappole_version_trigger
+    AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON fototrappole
+    FOR EACH STATEMENT EXECUTE FUNCTION fototrappole_version();
@@ -0,0 +1,85 @@
+-- benchmark of the search queries on 1 million synthetic sightings
+-- the data are created in the "bench" schema, removed at the end (the archive
+-- tables and their sequences are not modified)
+-- psql -d sighting -f sql/search_benchmark.sql
+
+\timing on
+
+-- the extension of sql/search_indexes.sql is created in public (not in bench,
+-- where DROP SCHEMA would remove it)
+CREATE EXTENSION IF NOT EXISTS pg_trgm SCHEMA public;
+
+DROP SCHEMA IF EXISTS bench CASCADE;
+CREATE SCHEMA bench;
+-- without the defaults: the serial columns would use (and advance) the
+-- sequences of the archive tables
+CREATE TABLE bench.sighting (LIKE public.sighting INCLUDING ALL EXCLUDING DEFAULTS);
+CREATE TABLE bench.fototrappole (LIKE public.fototrappole INCLUDING ALL EXCLUDING DEFAULTS);
+-- empty, for the indexes of sql/search_indexes.sql on media
+CREATE TABLE bench.media (LIKE public.media INCLUDING ALL EXCLUDING DEFAULTS);
+
+-- the serial columns (id) of the archive tables become identity columns
+DO $$
+DECLARE
+    col record;
+BEGIN
+    FOR col IN
+        SELECT table_name, column_name FROM information_schema.columns
+        WHERE table_schema = 'public'
+          AND table_name IN ('sighting', 'fototrappole', 'media')
+          AND column_default LIKE 'nextval(%'
+    LOOP
+        EXECUTE format(
+            'ALTER TABLE bench.%I ALTER COLUMN %I ADD GENERATED ALWAYS AS IDENTITY',
+            col.table_name, col.column_name
+        );
+    END LOOP;
+END
+$$;
+
+SET search_path = bench, public;
+
+INSERT INTO fototrappole (codice, tipo, data_inizio, regione, provincia, comune, latitudine, longitudine, operator)
+SELECT 'CT' || lpad(i::text, 4, '0'), 'video', '2020-01-01',
+       (ARRAY['Piemonte', 'Liguria', 'Lombardia', 'Valle d''Aosta'])[1 + i % 4],
+       (ARRAY['TO', 'CN', 'AL', 'GE', 'SV', 'BG', 'AO'])[1 + i % 7],
+       'comune ' || i, 44 + random() * 2, 7 + random() * 2, 'bench'
+FROM generate_series(1, 2000) AS i;
+
+INSERT INTO sighting (code, operator, institution, timestamp, camtrap_id, scalp, wolf_number, latitude, longitude, notes)
+SELECT 'B' || i, 'bench', 'bench',
+       timestamp '2020-01-01' + random() * interval '5 years',
+       'CT' || lpad((1 + i % 2000)::text, 4, '0'),
+       (ARRAY['C1', 'C3'])[1 + i % 2],
+       i % 8,
+       44 + random() * 2, 7 + random() * 2,
+       CASE WHEN i % 50 = 0 THEN 'lupo con collare ' || i ELSE NULL END
+FROM generate_series(1, 1000000) AS i;
+
+\i sql/search_indexes.sql
+ANALYZE sighting;
+ANALYZE fototrappole;
+
+-- date range
+EXPLAIN ANALYZE SELECT sighting.id FROM sighting LEFT JOIN fototrappole ON fototrappole.codice = sighting.camtrap_id
+WHERE sighting.timestamp >= '2023-03-01' AND sighting.timestamp < '2023-03-08' ORDER BY sighting.id DESC LIMIT 101;
+
+-- camera trap, next page
+EXPLAIN ANALYZE SELECT sighting.id FROM sighting LEFT JOIN fototrappole ON fototrappole.codice = sighting.camtrap_id
+WHERE sighting.camtrap_id = 'CT0042' AND sighting.id < 500000 ORDER BY sighting.id DESC LIMIT 101;
+
+-- province and SCALP class
+EXPLAIN ANALYZE SELECT sighting.id FROM sighting LEFT JOIN fototrappole ON fototrappole.codice = sighting.camtrap_id
+WHERE fototrappole.provincia = 'CN' AND sighting.scalp = 'C1' ORDER BY sighting.id DESC LIMIT 101;
+
+-- bounding box
+EXPLAIN ANALYZE SELECT sighting.id FROM sighting LEFT JOIN fototrappole ON fototrappole.codice = sighting.camtrap_id
+WHERE point(sighting.longitude::float8, sighting.latitude::float8) <@ box(point(7.5, 44.5), point(7.52, 44.52))
+ORDER BY sighting.id DESC LIMIT 101;
+
+-- notes
+EXPLAIN ANALYZE SELECT sighting.id FROM sighting LEFT JOIN fototrappole ON fototrappole.codice = sighting.camtrap_id
+WHERE sighting.notes ILIKE '%collare 4242%' ORDER BY sighting.id DESC LIMIT 101;
+
+RESET search_path;
+DROP SCHEMA bench CASCADE;
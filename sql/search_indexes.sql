@@ -0,0 +1,25 @@
+-- indexes for the search of the sightings (sighting_search.py)
+-- psql -d sighting -f sql/search_indexes.sql
+
+CREATE EXTENSION IF NOT EXISTS pg_trgm;
+
+-- filters (the id is included for the keyset pagination)
+CREATE INDEX IF NOT EXISTS sighting_timestamp_idx ON sighting (timestamp, id);
+CREATE INDEX IF NOT EXISTS sighting_camtrap_id_idx ON sighting (camtrap_id, id);
+CREATE INDEX IF NOT EXISTS sighting_scalp_idx ON sighting (scalp, id);
+CREATE INDEX IF NOT EXISTS sighting_wolf_number_idx ON sighting (wolf_number, id);
+
+-- bounding box (same expression as in sighting_search.search_query)
+CREATE INDEX IF NOT EXISTS sighting_position_idx ON sighting
+    USING gist (point(longitude::float8, latitude::float8));
+
+-- text of the notes (ILIKE '%...%')
+CREATE INDEX IF NOT EXISTS sighting_notes_trgm_idx ON sighting
+    USING gin (notes gin_trgm_ops);
+
+-- joins
+CREATE INDEX IF NOT EXISTS media_sighting_id_idx ON media (sighting_id);
+CREATE INDEX IF NOT EXISTS media_file_content_md5_idx ON media (file_content_md5);
+CREATE INDEX IF NOT EXISTS fototrappole_codice_idx ON fototrappole (codice);
+CREATE INDEX IF NOT EXISTS fototrappole_regione_idx ON fototrappole (regione);
+CREATE INDEX IF NOT EXISTS fototrappole_provincia_idx ON fototrappole (provincia);
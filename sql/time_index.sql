@@ -0,0 +1,4 @@
+-- timestamps of the sightings of a camera trap, loaded by time_index.py
+-- psql -d sighting -f sql/time_index.sql
+
+CREATE INDEX IF NOT EXISTS sighting_camtrap_id_timestamp_idx ON sighting (camtrap_id, timestamp);
@@ -0,0 +1,356 @@
+"""
+storage
+Storage of the uploaded files.
+
+The files are saved in UPLOAD_FOLDER/YYYY/MM/DD/<username>/ instead of a single
+flat directory. media.new_file_name contains the path relative to UPLOAD_FOLDER
+(e.g. 2025/03/14/olivier/1741950000_olivier.avi); the files uploaded before the
+sharding are still in UPLOAD_FOLDER (new_file_name without directory).
+
+The bytes and the number of the files uploaded by each operator are recorded
+in the operator_storage table (the MP4 previews of the AVI videos are not counted).
+
+The garbage collector removes the uploaded files not referenced by a media
+(upload not followed by save_info) older than the grace period, with their MP4
+preview and the temporary files of the interrupted conversions.
+The MP4 previews are recognized by the registry of the transcoder
+(TRANSCODE_REGISTRY_NAME in UPLOAD_FOLDER), so a preview whose video was
+already removed is not counted as an upload of the operator.
+The directories are scanned with os.scandir and the database is queried for
+batches of BATCH_SIZE files of the same directory.
+
+Require the table and the index in sql/operator_storage.sql
+
+Usage:
+python storage.py --dry-run
+python storage.py --grace-hours 48
+"""
+
+import argparse
+import datetime as dt
+import os
+import time
+from pathlib import Path, PurePosixPath
+
+from sqlalchemy import bindparam, create_engine, text
+
+import transcoder
+
+DATABASE_URL = "postgresql://sighting_user@localhost:5432/sighting"
+
+UPLOAD_FOLDER = "uploads"
+
+MEDIA_EXTENSIONS = {".avi", ".mp4", ".jpg", ".jpeg"}
+
+# files of a directory checked with one query
+BATCH_SIZE = 1000
+
+# an upload not followed by save_info is removed after GRACE_PERIOD
+GRACE_PERIOD = dt.timedelta(hours=48)
+
+# registry of the MP4 previews written by the transcoder (in UPLOAD_FOLDER)
+TRANSCODE_REGISTRY_NAME = "transcoded.json"
+
+
+def new_upload_path(upload_folder, username: str, suffix: str) -> tuple[str, Path]:
+    """
+    returns the path of a new uploaded file relative to upload_folder (for
+    media.new_file_name) and the path where the file is saved
+    the shard directory (YYYY/MM/DD/username) is created if missing
+    """
+    now = time.time()
+    shard = Path(time.strftime("%Y/%m/%d", time.localtime(now))) / username
+    (Path(upload_folder) / shard).mkdir(parents=True, exist_ok=True)
+    relative_path = shard / Path(f"{int(now)}_{username}").with_suffix(suffix)
+    return relative_path.as_posix(), Path(upload_folder) / relative_path
+
+
+def relative_path(upload_folder, file_path) -> str:
+    """
+    returns the path of file_path relative to upload_folder (as in media.new_file_name)
+    """
+    return Path(
+        os.path.relpath(os.path.abspath(file_path), os.path.abspath(upload_folder))
+    ).as_posix()
+
+
+def file_operator(relative_file_path: str) -> str:
+    """
+    returns the operator who uploaded the file
+    (shard directory or name of the files uploaded before the sharding)
+    """
+    path = PurePosixPath(relative_file_path)
+    if len(path.parts) == 5:
+        return path.parts[3]
+    return path.stem.split("_", 1)[-1]
+
+
+def update_usage(engine, operator: str, n_bytes: int, n_files: int = 1) -> None:
+    """
+    add n_bytes and n_files (negative for removed files) to the storage of the operator
+    """
+    with engine.connect() as conn:
+        conn.execute(
+            text("""
+                INSERT INTO operator_storage (operator, bytes, files)
+                VALUES (:operator, GREATEST(:bytes, 0), GREATEST(:files, 0))
+                ON CONFLICT (operator) DO UPDATE SET
+                    bytes = GREATEST(operator_storage.bytes + EXCLUDED.bytes, 0),
+                    files = GREATEST(operator_storage.files + EXCLUDED.files, 0),
+                    updated_at = now()
+            """),
+            {"operator": operator, "bytes": n_bytes, "files": n_files},
+        )
+        conn.commit()
+
+
+def operator_usage(engine, operator: str) -> dict:
+    """
+    returns the bytes and the number of the files uploaded by the operator
+    """
+    with engine.connect() as conn:
+        row = (
+            conn.execute(
+                text(
+                    "SELECT bytes, files FROM operator_storage WHERE operator = :operator"
+                ),
+                {"operator": operator},
+            )
+            .mappings()
+            .fetchone()
+        )
+    return dict(row) if row is not None else {"bytes": 0, "files": 0}
+
+
+def referenced_names(conn, names) -> set:
+    """
+    returns the names (relative paths) referenced by a media
+    """
+    query = text(
+        "SELECT new_file_name FROM media WHERE new_file_name IN :names"
+    ).bindparams(bindparam("names", expanding=True))
+    return set(conn.execute(query, {"names": list(names)}).scalars())
+
+
+def upload_names(name: str) -> list[str]:
+    """
+    returns the names of the uploads the file can belong to:
+    the file itself and, for a MP4, the video it was converted from
+    """
+    path = PurePosixPath(name)
+    names = [name]
+    if path.suffix.lower() == ".mp4":
+        names.extend(
+            str(path.with_suffix(suffix)) for suffix in transcoder.TRANSCODE_EXTENSIONS
+        )
+    return names
+
+
+def iter_batches(upload_folder, batch_size: int = BATCH_SIZE):
+    """
+    yield lists of at most batch_size (relative path, os.DirEntry) of the files
+    of the same directory
+    """
+    upload_folder = os.path.abspath(upload_folder)
+    directories = [upload_folder]
+    while directories:
+        current_dir = directories.pop()
+        batch = []
+        try:
+            with os.scandir(current_dir) as it:
+                for entry in it:
+                    if entry.is_dir(follow_symlinks=False):
+                        directories.append(entry.path)
+                        continue
+                    if not entry.is_file(follow_symlinks=False):
+                        continue
+                    batch.append((relative_path(upload_folder, entry.path), entry))
+                    if len(batch) == batch_size:
+                        yield batch
+                        batch = []
+        except OSError as e:
+            print(f"Error reading directory {current_dir}: {e}")
+        if batch:
+            yield batch
+
+
+def preview_paths(registry_path) -> set[str]:
+    """
+    returns the absolute paths of the MP4 previews recorded in the registry of
+    the transcoder
+    """
+    return {
+        os.path.abspath(output)
+        for output in transcoder.load_registry(registry_path).values()
+    }
+
+
+def collect_garbage(
+    engine,
+    upload_folder=UPLOAD_FOLDER,
+    grace_period: dt.timedelta = GRACE_PERIOD,
+    dry_run: bool = False,
+    batch_size: int = BATCH_SIZE,
+    registry_path=None,
+) -> dict:
+    """
+    remove the uploaded files not referenced by a media older than grace_period:
+    - uploaded files (upload not followed by save_info)
+    - MP4 previews of the removed videos
+    - temporary files of the conversions to MP4 (.NAME.part.mp4)
+    the files are only listed if dry_run is True
+    the MP4 previews are read from the registry of the transcoder registry_path
+    (default upload_folder/TRANSCODE_REGISTRY_NAME); the previews made before
+    the registry are recognized by the video they were converted from
+
+    returns the report: number of the checked files, number and bytes of the
+    removed files, bytes removed for each operator
+    """
+    cutoff = time.time() - grace_period.total_seconds()
+    report = {"checked": 0, "removed": 0, "bytes": 0, "operators": {}}
+    if registry_path is None:
+        registry_path = Path(upload_folder) / TRANSCODE_REGISTRY_NAME
+    previews = preview_paths(registry_path)
+
+    with engine.connect() as conn:
+        for batch in iter_batches(upload_folder, batch_size):
+            # relative path -> (entry, size, kind: upload, preview or part)
+            candidates = {}
+            for name, entry in batch:
+                base_name = PurePosixPath(name).name
+                suffix = PurePosixPath(name).suffix.lower()
+                if suffix not in MEDIA_EXTENSIONS:
+                    continue
+                if base_name.startswith("."):
+                    # temporary files of the transcoder (other hidden files are kept)
+                    if ".part." not in base_name:
+                        continue
+                    kind = "part"
+                elif suffix == ".mp4" and (
+                    entry.path in previews
+                    or any(
+                        Path(entry.path).with_suffix(source_suffix).exists()
+                        for source_suffix in transcoder.TRANSCODE_EXTENSIONS
+                    )
+                ):
+                    kind = "preview"
+                else:
+                    kind = "upload"
+                report["checked"] += 1
+                try:
+                    stat = entry.stat(follow_symlinks=False)
+                except OSError:
+                    continue
+                if stat.st_mtime >= cutoff:
+                    continue
+                candidates[name] = (entry, stat.st_size, kind)
+
+            if not candidates:
+                continue
+
+            referenced = referenced_names(
+                conn,
+                {
+                    upload_name
+                    for name, (_, _, kind) in candidates.items()
+                    if kind != "part"
+                    for upload_name in upload_names(name)
+                },
+            )
+
+            for name, (entry, size, kind) in candidates.items():
+                if kind != "part" and referenced.intersection(upload_names(name)):
+                    continue
+                if dry_run:
+                    print(f"{name} ({size} bytes) would be removed")
+                else:
+                    try:
+                        os.unlink(entry.path)
+                    except OSError as e:
+                        print(f"Error removing {name}: {e}")
+                        continue
+                report["removed"] += 1
+                report["bytes"] += size
+                # only the uploaded files are counted in operator_storage
+                if kind == "upload":
+                    removed = report["operators"].setdefault(
+                        file_operator(name), {"bytes": 0, "files": 0}
+                    )
+                    removed["bytes"] += size
+                    removed["files"] += 1
+
+    if not dry_run:
+        for operator, removed in report["operators"].items():
+            update_usage(engine, operator, -removed["bytes"], -removed["files"])
+
+    return report
+
+
+def parse_arguments():
+    """
+    parse command line arguments
+    """
+    parser = argparse.ArgumentParser(
+        description="Remove the uploaded files not followed by a sighting"
+    )
+    parser.add_argument(
+        "-d",
+        "--directory",
+        action="store",
+        dest="upload_folder",
+        default=UPLOAD_FOLDER,
+        help="Directory of the uploaded files",
+    )
+    parser.add_argument(
+        "--grace-hours",
+        action="store",
+        type=float,
+        dest="grace_hours",
+        default=GRACE_PERIOD.total_seconds() / 3600,
+        help="Files more recent than this number of hours are kept",
+    )
+    parser.add_argument(
+        "--dry-run",
+        action="store_true",
+        dest="dry_run",
+        help="List the files to remove without removing them",
+    )
+    parser.add_argument(
+        "--transcode-registry",
+        action="store",
+        dest="registry_path",
+        default=None,
+        help=f"Registry of the MP4 previews (default DIRECTORY/{TRANSCODE_REGISTRY_NAME})",
+    )
+    parser.add_argument(
+        "--database",
+        action="store",
+        dest="database_url",
+        default=DATABASE_URL,
+        help="Database URL",
+    )
+    return parser.parse_args()
+
+
+def main():
+    args = parse_arguments()
+    engine = create_engine(args.database_url)
+
+    report = collect_garbage(
+        engine,
+        args.upload_folder,
+        dt.timedelta(hours=args.grace_hours),
+        dry_run=args.dry_run,
+        registry_path=args.registry_path,
+    )
+
+    print(
+        f"{report['checked']} files checked, {report['removed']} files "
+        f"{'to remove' if args.dry_run else 'removed'} ({report['bytes']} bytes)"
+    )
+    for operator, removed in sorted(report["operators"].items()):
+        print(f"{operator}: {removed['files']} uploads, {removed['bytes']} bytes")
+
+
+if __name__ == "__main__":
+    main()
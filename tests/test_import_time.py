@@ -0,0 +1,74 @@
+"""
+startup benchmark: the CLI and the web app must not load OpenCV, numpy and
+pytesseract at import (python -X importtime)
+
+python -m pytest tests/test_import_time.py
+"""
+
+import subprocess
+import sys
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+
+HEAVY_MODULES = {"cv2", "numpy", "pytesseract"}
+
+# import video_upload without the database and the users module of the
+# deployment (not in the repository): users is stubbed if missing and the
+# engine is created on SQLite
+IMPORT_WEB_APP = """
+import importlib.util
+import sys
+import types
+
+import sqlalchemy
+
+if importlib.util.find_spec("users") is None:
+    sys.modules["users"] = types.SimpleNamespace(USERS={})
+create_engine = sqlalchemy.create_engine
+sqlalchemy.create_engine = lambda *args, **kwargs: create_engine("sqlite://")
+
+import video_upload
+"""
+
+
+def imported_modules(*args) -> tuple[set, int]:
+    """
+    run python -X importtime with args in the repository directory
+    returns the top-level names of the imported modules and the cumulative
+    import time of the slowest top-level module (microseconds)
+    """
+    process = subprocess.run(
+        [sys.executable, "-X", "importtime", *args],
+        cwd=ROOT,
+        capture_output=True,
+        text=True,
+    )
+    # the stderr lines that are not the import times (traceback)
+    errors = [
+        line
+        for line in process.stderr.splitlines()
+        if not line.startswith("import time:")
+    ]
+    assert process.returncode == 0, errors[-1] if errors else process.stderr
+
+    modules = set()
+    slowest = 0
+    for line in process.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line.removeprefix("import time:").split("|")
+        modules.add(name.strip().split(".")[0])
+        if not name.startswith("  "):
+            slowest = max(slowest, int(cumulative))
+    return modules, slowest
+
+
+def test_cli_version_does_not_load_heavy_modules():
+    modules, slowest = imported_modules("camtrap_banner_decoder.py", "-v")
+    assert not modules & HEAVY_MODULES, f"slowest import: {slowest} us"
+
+
+def test_web_app_does_not_load_heavy_modules():
+    modules, slowest = imported_modules("-c", IMPORT_WEB_APP)
+    assert not modules & HEAVY_MODULES, f"slowest import: {slowest} us"
@@ -0,0 +1,153 @@
+"""
+time_index
+Index of the dates/times of the sightings of each camera trap, used to check
+the date/time read by the OCR on the banner of an uploaded file.
+
+A date/time is suspect if it is:
+- in the future
+- outside the activity period of the camera trap (fototrappole.data_inizio/data_fine)
+- the date/time of another sighting of the camera trap
+- far (MAX_GAP) from all the other sightings of the camera trap
+
+The timestamps of a camera trap are loaded from the database at the first check
+(sorted list, bisect), kept for TTL seconds and updated by save_info with add().
+Each process (web worker) has its own index.
+
+Uses the index in sql/time_index.sql
+"""
+
+import bisect
+import datetime as dt
+import threading
+import time
+
+from sqlalchemy import text
+
+import reference_cache
+
+TTL = 300
+
+# maximum time between a sighting and the nearest sighting of the same camera trap
+MAX_GAP = dt.timedelta(days=180)
+
+
+class CameraTimeIndex:
+    """
+    sorted timestamps of the sightings of each camera trap
+    """
+
+    def __init__(self, ttl: float = TTL, max_gap: dt.timedelta = MAX_GAP):
+        self.ttl = ttl
+        self.max_gap = max_gap
+        # camtrap_id -> (expiration time, sorted list of timestamps)
+        self._data: dict = {}
+        self._lock = threading.Lock()
+
+    def timestamps(self, engine, camtrap_id: str) -> list:
+        """
+        returns the sorted timestamps of the sightings of camtrap_id
+        (loaded from the database if missing or expired)
+        """
+        now = time.monotonic()
+        with self._lock:
+            item = self._data.get(camtrap_id)
+            if item is not None and item[0] > now:
+                return item[1]
+
+        with engine.connect() as conn:
+            timestamps = list(
+                conn.execute(
+                    text(
+                        "SELECT timestamp FROM sighting "
+                        "WHERE camtrap_id = :camtrap_id AND timestamp IS NOT NULL "
+                        "ORDER BY timestamp"
+                    ),
+                    {"camtrap_id": camtrap_id},
+                ).scalars()
+            )
+
+        with self._lock:
+            self._data[camtrap_id] = (now + self.ttl, timestamps)
+        return timestamps
+
+    def add(self, camtrap_id: str, timestamp: dt.datetime) -> None:
+        """
+        add the timestamp of a new sighting (if camtrap_id is loaded)
+        """
+        with self._lock:
+            item = self._data.get(camtrap_id)
+            if item is not None:
+                bisect.insort(item[1], timestamp)
+
+    def invalidate(self, camtrap_id: str | None = None) -> None:
+        """
+        remove camtrap_id from the index (all the camera traps if camtrap_id is None)
+        """
+        with self._lock:
+            if camtrap_id is None:
+                self._data.clear()
+            else:
+                self._data.pop(camtrap_id, None)
+
+    def check(
+        self, engine, camtrap_id: str | None, timestamp: dt.datetime
+    ) -> list[str]:
+        """
+        returns the reasons why timestamp is suspect for camtrap_id
+        (empty list if the timestamp is plausible)
+        only the future dates are checked if camtrap_id is None
+        """
+        reasons = []
+
+        if timestamp > dt.datetime.now() + dt.timedelta(days=1):
+            reasons.append("data nel futuro")
+
+        if camtrap_id is None:
+            return reasons
+
+        fototrappola = reference_cache.get_fototrappola(engine, camtrap_id)
+        if fototrappola is not None:
+            if (
+                fototrappola["data_inizio"] is not None
+                and timestamp.date() < fototrappola["data_inizio"]
+            ):
+                reasons.append(
+                    f"data precedente all'installazione ({fototrappola['data_inizio']})"
+                )
+            if (
+                fototrappola["data_fine"] is not None
+                and timestamp.date() > fototrappola["data_fine"]
+            ):
+                reasons.append(
+                    f"data successiva alla rimozione ({fototrappola['data_fine']})"
+                )
+
+        timestamps = self.timestamps(engine, camtrap_id)
+        with self._lock:
+            idx = bisect.bisect_left(timestamps, timestamp)
+            neighbors = timestamps[max(idx - 1, 0) : idx + 1]
+        if timestamp in neighbors:
+            reasons.append("data e ora di un altro avvistamento")
+        elif neighbors and min(abs(timestamp - n) for n in neighbors) > self.max_gap:
+            reasons.append(
+                f"nessun altro avvistamento della fototrappola entro {self.max_gap.days} giorni"
+            )
+
+        return reasons
+
+
+index = CameraTimeIndex()
+
+
+def check(engine, camtrap_id: str | None, timestamp: dt.datetime) -> list[str]:
+    """
+    returns the reasons why timestamp is suspect for camtrap_id
+    """
+    return index.check(engine, camtrap_id, timestamp)
+
+
+def add(camtrap_id: str, timestamp: dt.datetime) -> None:
+    """
+    add the timestamp of a new sighting of camtrap_id
+    """
+    index.add(camtrap_id, timestamp)
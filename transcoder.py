@@ -0,0 +1,240 @@
+"""
+transcoder
+Re-encode videos (AVI) to MP4 playable in the browser with ffmpeg.
+
+The files are encoded by a bounded pool of workers, the MP4 is written with the
+moov atom at the beginning (fast-start) so the browser can start the playback
+before downloading the whole file.
+The already transcoded files are recorded in a JSON registry keyed by the MD5
+of the source file content and are not encoded again.
+
+Require: ffmpeg program (see https://ffmpeg.org)
+"""
+
+import hashlib
+import json
+import os
+import subprocess
+import tempfile
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from pathlib import Path
+
+TRANSCODE_EXTENSIONS = {".avi"}
+
+FFMPEG_OPTIONS = [
+    "-c:v",
+    "libx264",
+    "-preset",
+    "veryfast",
+    "-crf",
+    "23",
+    "-pix_fmt",
+    "yuv420p",
+    "-c:a",
+    "aac",
+    "-movflags",
+    "+faststart",
+]
+
+
+def file_md5(file_path, chunk_size: int = 1024 * 1024) -> str:
+    """
+    returns the MD5 of the file content
+    """
+    md5 = hashlib.md5()
+    with open(file_path, "rb") as f_in:
+        for chunk in iter(lambda: f_in.read(chunk_size), b""):
+            md5.update(chunk)
+    return md5.hexdigest()
+
+
+def video_duration(video_path) -> float:
+    """
+    returns the duration of the video in seconds (0 if unknown)
+    """
+    import cv2
+
+    cap = cv2.VideoCapture(str(video_path))
+    try:
+        fps = cap.get(cv2.CAP_PROP_FPS)
+        frame_count = cap.get(cv2.CAP_PROP_FRAME_COUNT)
+    finally:
+        cap.release()
+    if fps and frame_count:
+        return frame_count / fps
+    return 0
+
+
+def load_registry(registry_path) -> dict:
+    """
+    returns the registry of the transcoded files (MD5 of the source -> MP4 path)
+    """
+    registry_path = Path(registry_path)
+    if not registry_path.is_file():
+        return {}
+    try:
+        return json.loads(registry_path.read_text())
+    except (OSError, ValueError):
+        return {}
+
+
+class TranscodeQueue:
+    """
+    queue of videos to transcode to fast-start MP4
+    """
+
+    def __init__(self, ffmpeg_path="ffmpeg", max_workers: int = 2, registry_path=None):
+        """
+        Args:
+            ffmpeg_path (str): path of the ffmpeg executable
+            max_workers (int): number of ffmpeg processes running at the same time
+            registry_path (str): JSON file recording the transcoded files (None for no registry)
+        """
+        self.ffmpeg_path = ffmpeg_path
+        self.registry_path = Path(registry_path) if registry_path else None
+        self._executor = ThreadPoolExecutor(
+            max_workers=max_workers, thread_name_prefix="transcoder"
+        )
+        self._lock = threading.Lock()
+        # source path -> {"state", "progress", "output", "error"}
+        self._jobs: dict[str, dict] = {}
+        self._registry: dict[str, str] = self._load_registry()
+
+    def _load_registry(self) -> dict:
+        if self.registry_path is None:
+            return {}
+        return load_registry(self.registry_path)
+
+    def _save_registry(self) -> None:
+        """
+        write the registry atomically (call with the lock held)
+        """
+        if self.registry_path is None:
+            return
+        tmp_path = self.registry_path.with_suffix(".tmp")
+        tmp_path.write_text(json.dumps(self._registry, indent=0))
+        os.replace(tmp_path, self.registry_path)
+
+    def transcoded(self, content_md5: str) -> Path | None:
+        """
+        returns the path of the transcoded file for the content or None
+        """
+        with self._lock:
+            output = self._registry.get(content_md5)
+        if output and Path(output).is_file():
+            return Path(output)
+        return None
+
+    def progress(self, src) -> dict | None:
+        """
+        returns the state of the transcoding of src (None if src was never submitted)
+        state is "queued", "running", "done" or "error", progress is between 0 and 1
+        """
+        with self._lock:
+            job = self._jobs.get(str(src))
+            return dict(job) if job is not None else None
+
+    def submit(self, src, dst=None, content_md5: str = "") -> Future:
+        """
+        add src to the queue
+
+        Args:
+            src (str): path of the video to transcode
+            dst (str): path of the MP4 file (default src with .mp4 suffix)
+            content_md5 (str): MD5 of the src content (computed if empty)
+
+        Returns:
+            Future: result is the path of the MP4 file
+        """
+        src = Path(src)
+        dst = Path(dst) if dst else src.with_suffix(".mp4")
+
+        with self._lock:
+            job = self._jobs.get(str(src))
+            if job is not None and job["state"] in ("queued", "running"):
+                return job["future"]
+            job = {
+                "state": "queued",
+                "progress": 0,
+                "output": str(dst),
+                "error": "",
+            }
+            job["future"] = self._executor.submit(self._run, src, dst, content_md5)
+            self._jobs[str(src)] = job
+        return job["future"]
+
+    def _update(self, src: Path, **kwargs) -> None:
+        with self._lock:
+            self._jobs[str(src)].update(kwargs)
+
+    def _run(self, src: Path, dst: Path, content_md5: str) -> Path:
+        try:
+            if not content_md5:
+                content_md5 = file_md5(src)
+
+            already_transcoded = self.transcoded(content_md5)
+            if already_transcoded is not None:
+                self._update(
+                    src, state="done", progress=1, output=str(already_transcoded)
+                )
+                return already_transcoded
+
+            if dst.exists():
+                raise FileExistsError(f"{dst} already exists")
+
+            self._update(src, state="running")
+            self._ffmpeg(src, dst)
+
+            with self._lock:
+                self._registry[content_md5] = str(dst)
+                self._save_registry()
+            self._update(src, state="done", progress=1)
+            return dst
+
+        except Exception as e:
+            self._update(src, state="error", error=str(e))
+            raise
+
+    def _ffmpeg(self, src: Path, dst: Path) -> None:
+        """
+        run ffmpeg and record the progress
+        the output is written in a temporary file renamed at the end
+        """
+        duration = video_duration(src)
+        tmp_dst = dst.with_name(f".{dst.stem}.part{dst.suffix}")
+        command = [
+            self.ffmpeg_path,
+            "-nostdin",
+            "-y",
+            "-loglevel",
+            "error",
+            "-i",
+            str(src),
+            *FFMPEG_OPTIONS,
+            "-progress",
+            "pipe:1",
+            "-nostats",
+            str(tmp_dst),
+        ]
+        with tempfile.TemporaryFile() as stderr:
+            p = subprocess.Popen(
+                command, stdout=subprocess.PIPE, stderr=stderr, text=True
+            )
+            for line in p.stdout:
+                key, _, value = line.strip().partition("=")
+                if key == "out_time_us" and duration and value.isdigit():
+                    self._update(
+                        src, progress=min(int(value) / 1_000_000 / duration, 0.99)
+                    )
+            p.wait()
+            if p.returncode:
+                stderr.seek(0)
+                tmp_dst.unlink(missing_ok=True)
+                raise RuntimeError(
+                    f"ffmpeg error ({p.returncode}): {stderr.read().decode(errors='replace').strip()}"
+                )
+        os.replace(tmp_dst, dst)
+
+    def shutdown(self, wait: bool = True) -> None:
+        self._executor.shutdown(wait=wait)
@@ -1,31 +1,48 @@
 import base64
+import datetime as dt
 import hashlib
 import os
-import time
 from pathlib import Path
 
-import cv2
 from flask import (
     Flask,
+    Response,
+    abort,
     flash,
+    jsonify,
+    make_response,
     redirect,
     render_template,
     request,
-    send_from_directory,
     session,
+    stream_with_context,
     url_for,
 )
-from markupsafe import Markup
+from markupsafe import Markup, escape
 from sqlalchemy import create_engine, text
 from werkzeug.utils import secure_filename
 
-import camtrap_banner_decoder
+import camtrap_import
+import media_serving
+import ocr_service
+import reference_cache
+import sighting_export
+import sighting_search
+import storage
+import time_index
+import transcoder
 import users
 
 app = Flask(__name__)
 app.secret_key = "secret-key"  # cambia in produzione
-UPLOAD_FOLDER = "uploads"
+# uploaded files in UPLOAD_FOLDER/YYYY/MM/DD/<username>/ (see storage.py)
+UPLOAD_FOLDER = storage.UPLOAD_FOLDER
 app.config["UPLOAD_FOLDER"] = UPLOAD_FOLDER
+# "" (Flask sends the files), "x-accel" (nginx) or "x-sendfile" (Apache)
+app.config["MEDIA_ACCEL"] = os.environ.get("MEDIA_ACCEL", "")
+app.config["MEDIA_ACCEL_PREFIX"] = os.environ.get(
+    "MEDIA_ACCEL_PREFIX", "/protected_uploads/"
+)
 
 if not os.path.exists(UPLOAD_FOLDER):
     os.makedirs(UPLOAD_FOLDER)
@@ -99,15 +116,16 @@ def elenco_fototrappole():
     """
     elenco fototrappola
     """
-    with engine.connect() as conn:
-        sql = text("SELECT * FROM fototrappole WHERE operator = :operator")
-        fototrappole = (
-            conn.execute(sql, {"operator": session["username"]}).mappings().all()
-        )
+    fototrappole = reference_cache.get_operator_fototrappole(
+        engine, session["username"]
+    )
     return render_template("elenco_fototrappole.html", fototrappole=fototrappole)
 
 
 def extract_frame(video_path, time_sec):
+    # OpenCV is loaded only when a sighting is saved
+    import cv2
+
     cap = cv2.VideoCapture(video_path)
 
     # Set video position (in milliseconds)
@@ -137,27 +155,65 @@ def extract_frame(video_path, time_sec):
     cap.release()
 
 
+def fototrappola_details(fototrappola: dict | None) -> str:
+    """
+    HTML details of the fototrappola
+    """
+    if fototrappola is None:
+        return ""
+    return (
+        f"{fototrappola['tipo']}<br>{fototrappola['nome']} {fototrappola['cognome']}<br>"
+        f"{fototrappola['comune']} {fototrappola['provincia']} {fototrappola['regione']}"
+    )
+
+
+def date_time_warnings(camtrap_id: str, date: str, time_: str) -> list[str]:
+    """
+    returns the reasons why the date and time (HH:MM:SS) are suspect for the
+    camera trap (see time_index.py)
+    """
+    if not camtrap_id or not date or not time_:
+        return []
+    try:
+        timestamp = dt.datetime.fromisoformat(f"{date} {time_}")
+    except ValueError:
+        return []
+    return time_index.check(engine, camtrap_id, timestamp)
+
+
 @app.route("/get_fototrappola_data", methods=["GET"])
 def get_fototrappola_data():
     camtrap_id = request.args.get("camtrap_id")
     if not camtrap_id:
         return ""
     print(f"{camtrap_id=}")
-    with engine.connect() as conn:
-        fototrappola = (
-            conn.execute(
-                text("SELECT * FROM fototrappole WHERE codice = :codice"),
-                {"codice": camtrap_id},
-            )
-            .mappings()
-            .fetchone()
-        )
-    out = (
-        f"{fototrappola.tipo}<br>{fototrappola.nome} {fototrappola.cognome}<br>"
-        f"{fototrappola.comune} {fototrappola.provincia} {fototrappola.regione}"
+    out = fototrappola_details(reference_cache.get_fototrappola(engine, camtrap_id))
+
+    # date and time of the uploaded file checked with the selected camera trap
+    warnings = date_time_warnings(
+        camtrap_id, request.args.get("date"), request.args.get("time_")
     )
+    if warnings:
+        out += (
+            '<p class="has-text-danger mt-2">Data e ora da verificare: '
+            f"{escape(', '.join(warnings))}</p>"
+        )
 
-    return out
+    # the browser revalidates with If-None-Match and gets 304 if unchanged
+    response = make_response(out)
+    response.set_etag(hashlib.md5(out.encode("utf-8")).hexdigest())
+    response.cache_control.private = True
+    response.cache_control.no_cache = True
+    return response.make_conditional(request)
+
+
+@app.route(APP_ROOT + "/cache_stats")
+@login_required
+def cache_stats():
+    """
+    hit/miss counters of the reference data cache
+    """
+    return jsonify(reference_cache.stats())
 
 
 @app.route(APP_ROOT + "/nuova_fototrappola", methods=["GET", "POST"])
@@ -194,8 +250,51 @@ def save_info():
     file_content_md5 = request.form.get("file_content_md5")
     date = request.form.get("date")
     time_ = request.form.get("time_")
+    date_confirmed = request.form.get("date_confirmed")
     video_url = url_for("uploaded_file", filename=new_file_name)
 
+    def render_form(date_confirmed=""):
+        """
+        show the form again with the values of the operator
+        """
+        # list of fototrappole
+        fototrappole = reference_cache.get_operator_fototrappole(
+            engine, session["username"]
+        )
+        fototrappola = reference_cache.get_fototrappola(engine, camtrap_id)
+        return render_template(
+            "upload_info.html",
+            original_file_name=original_file_name,
+            new_file_name=str(new_file_name),
+            video_url=video_url,
+            operator=session["fullname"],
+            code=code,
+            date=date,
+            time_=time_,
+            date_confirmed=date_confirmed,
+            file_content_md5=file_content_md5,
+            camtrap_id=camtrap_id,
+            wolf_number=wolf_number,
+            notes=notes if notes is not None else "",
+            latitude=latitude,
+            longitude=longitude,
+            transect_id=transect_id if transect_id is not None else "",
+            scalp=scalp,
+            fototrappole=fototrappole,
+            fototrappola_details=Markup(fototrappola_details(fototrappola)),
+        )
+
+    # date and time read by the OCR checked with the camera trap selected by the operator
+    if not date_confirmed:
+        warnings = date_time_warnings(camtrap_id, date, time_)
+        if warnings:
+            flash(
+                f"Data e ora da verificare per la fototrappola {camtrap_id}: "
+                f"{', '.join(warnings)}. Salvare di nuovo per confermare.",
+                "warning",
+            )
+            return render_form(date_confirmed="1")
+
     with engine.connect() as conn:
         # check if code already present in database
         query = text("SELECT COUNT(*) FROM sighting WHERE code = :code")
@@ -207,52 +306,7 @@ def save_info():
                 ),
                 "danger",
             )
-
-            # list of fototrappole
-            with engine.connect() as conn:
-                fototrappole = (
-                    conn.execute(
-                        text(
-                            "SELECT codice FROM fototrappole WHERE operator = :operator"
-                        ),
-                        {"operator": session["username"]},
-                    )
-                    .mappings()
-                    .all()
-                )
-
-                fototrappola = (
-                    conn.execute(
-                        text("SELECT * FROM fototrappole WHERE codice = :camtrap_id"),
-                        {"camtrap_id": camtrap_id},
-                    )
-                    .mappings()
-                    .fetchone()
-                )
-                fototrappola_details = (
-                    f"{fototrappola.tipo}<br>{fototrappola.nome} {fototrappola.cognome}<br>"
-                    f"{fototrappola.comune} {fototrappola.provincia} {fototrappola.regione}"
-                )
-            return render_template(
-                "upload_info.html",
-                original_file_name=original_file_name,
-                new_file_name=str(new_file_name),
-                video_url=video_url,
-                operator=session["fullname"],
-                code=code,
-                date=date,
-                time_=time_,
-                file_content_md5=file_content_md5,
-                camtrap_id=camtrap_id,
-                wolf_number=wolf_number,
-                notes=notes if notes is not None else "",
-                latitude=latitude,
-                longitude=longitude,
-                transect_id=transect_id if transect_id is not None else "",
-                scalp=scalp,
-                fototrappole=fototrappole,
-                fototrappola_details=Markup(fototrappola_details),
-            )
+            return render_form(date_confirmed)
 
         query = text("""
             INSERT INTO sighting
@@ -268,7 +322,7 @@ def save_info():
                 "code": code,
                 "operator": session["username"],
                 "institution": session["institution"],
-                "timestamp": None,
+                "timestamp": f"{date} {time_}" if date and time_ else None,
                 "camtrap_id": camtrap_id,
                 "scalp": scalp,
                 "transect_id": transect_id if transect_id else None,
@@ -281,6 +335,12 @@ def save_info():
         sighting_id = result.scalar()
         conn.commit()
 
+        if date and time_:
+            try:
+                time_index.add(camtrap_id, dt.datetime.fromisoformat(f"{date} {time_}"))
+            except ValueError:
+                pass
+
         # save media
         jpg_content = extract_frame(
             str(Path(app.config["UPLOAD_FOLDER"]) / Path(new_file_name)), 1
@@ -378,6 +438,8 @@ def save_fototrappola():
 
                 conn.commit()
 
+            reference_cache.invalidate(codice=codice, operator=session["username"])
+
             flash("Nuova fototrappola inserita con successo!", "success")
             return redirect(url_for("index"))
 
@@ -388,6 +450,36 @@ def save_fototrappola():
             return redirect(url_for("nuova_fototrappola"))
 
 
+@app.route(APP_ROOT + "/import_fototrappole", methods=["GET", "POST"])
+@login_required
+def import_fototrappole():
+    """
+    import fototrappole from a CSV or GeoJSON file
+    """
+    if request.method == "GET":
+        return render_template(
+            "import_fototrappole.html", fields=camtrap_import.FIELDS, report=[]
+        )
+
+    file = request.files.get("file")
+    if not file or not file.filename:
+        flash("Nessun file caricato!", "danger")
+        return redirect(url_for("import_fototrappole"))
+
+    n_imported, report = camtrap_import.import_fototrappole(
+        engine, file.stream, file.filename, session["username"]
+    )
+    reference_cache.invalidate()
+
+    flash(
+        f"{n_imported} fototrappole importate, {len(report)} errori.",
+        "success" if not report else "warning",
+    )
+    return render_template(
+        "import_fototrappole.html", fields=camtrap_import.FIELDS, report=report
+    )
+
+
 @app.route(APP_ROOT + "/sighting_list")
 @login_required
 def sighting_list():
@@ -408,6 +500,112 @@ def sighting_list():
     return render_template("sighting_list.html", sightings=results)
 
 
+@app.route(APP_ROOT + "/api/sightings")
+@login_required
+def api_sightings():
+    """
+    search the sightings (JSON), see sighting_search.py for the filters
+    """
+    try:
+        filters = sighting_search.parse_filters(request.args)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    with engine.connect() as conn:
+        sightings, next_cursor = sighting_search.search_sightings(conn, filters)
+
+    return jsonify({"sightings": sightings, "next": next_cursor})
+
+
+@app.route(APP_ROOT + "/export")
+@login_required
+def export():
+    """
+    export the sightings (format=csv, parquet or camtrapdp) streamed in the response
+    """
+    export_format = request.args.get("format", "csv")
+    if export_format not in sighting_export.FORMATS:
+        abort(400)
+    try:
+        sighting_export.check_format(export_format)
+    except RuntimeError as e:
+        abort(501, description=str(e))
+    mimetype, suffix = sighting_export.FORMATS[export_format]
+    return Response(
+        stream_with_context(sighting_export.iter_export(engine, export_format)),
+        mimetype=mimetype,
+        headers={"Content-Disposition": f"attachment; filename=sightings{suffix}"},
+    )
+
+
+@app.route(APP_ROOT + "/thumbnail/<int:media_id>")
+@login_required
+def thumbnail(media_id: int):
+    """
+    thumbnail of the media (referenced by media_id in the exports)
+    """
+    with engine.connect() as conn:
+        image = conn.execute(
+            text("SELECT image FROM media WHERE id = :media_id"),
+            {"media_id": media_id},
+        ).scalar()
+    if image is None:
+        abort(404)
+    response = Response(bytes(image), mimetype="image/jpeg")
+    response.cache_control.private = True
+    response.cache_control.max_age = media_serving.MEDIA_MAX_AGE
+    return response
+
+
+def decode_banner(file_path: Path, operator: str) -> tuple[dict, str | None, list]:
+    """
+    read the date and time on the banner of an uploaded file
+    the cheap OCR tier is used first, the expensive tiers only if the result is
+    suspect (not read, low confidence or not plausible for the camera trap, see time_index.py)
+
+    Returns:
+        tuple: data extracted from the banner,
+               camera trap (camera ID of the banner if it is a camera trap of the operator),
+               reasons why the date and time are suspect
+    """
+    codici = {
+        fototrappola["codice"]
+        for fototrappola in reference_cache.get_operator_fototrappole(engine, operator)
+    }
+
+    def check(data):
+        if "error" in data:
+            return None, ["data e ora non lette"]
+        camtrap_id = data["cam_id"] if data["cam_id"] in codici else None
+        reasons = []
+        if data["confidence"] < ocr_service.MIN_CONFIDENCE:
+            reasons.append(f"lettura incerta (confidenza {data['confidence']})")
+        timestamp = dt.datetime.strptime(
+            f"{data['date']} {data['time']}", "%Y-%m-%d %H%M%S"
+        )
+        checks = time_index.check(engine, camtrap_id, timestamp)
+        if checks and camtrap_id is not None and timestamp.day <= 12:
+            # month and day swapped by the OCR or the camera settings
+            swapped = timestamp.replace(month=timestamp.day, day=timestamp.month)
+            if not time_index.check(engine, camtrap_id, swapped):
+                checks.append(f"giorno e mese invertiti? ({swapped.date()})")
+        return camtrap_id, reasons + checks
+
+    data = ocr_service.extract_date_time(file_path, ocr_service.FAST_TIERS)
+    camtrap_id, reasons = check(data)
+    if reasons:
+        retry = ocr_service.extract_date_time(file_path, ocr_service.RETRY_TIERS)
+        retry_camtrap_id, retry_reasons = check(retry)
+        if "error" not in retry and (
+            "error" in data
+            or (len(retry_reasons), -retry["confidence"])
+            < (len(reasons), -data["confidence"])
+        ):
+            data, camtrap_id, reasons = retry, retry_camtrap_id, retry_reasons
+
+    return data, camtrap_id, reasons
+
+
 @app.route(APP_ROOT + "/upload_video", methods=["POST"])
 @login_required
 def upload_video():
@@ -455,14 +653,16 @@ def upload_video():
     original_file_name = secure_filename(video.filename)
     print(f"{original_file_name=}")
 
-    # get new file name
-    new_file_name = Path(f"{int(time.time())}_{session['username']}").with_suffix(
-        Path(original_file_name).suffix
+    # get new file name (path relative to UPLOAD_FOLDER)
+    new_file_name, save_path = storage.new_upload_path(
+        app.config["UPLOAD_FOLDER"],
+        session["username"],
+        Path(original_file_name).suffix,
     )
     print(f"{new_file_name=}")
 
-    save_path = Path(app.config["UPLOAD_FOLDER"]) / new_file_name
     video.save(save_path)
+    storage.update_usage(engine, session["username"], save_path.stat().st_size)
 
     # md5 of file content
     # file_content_md5 = hashlib.md5(open(save_path, "rb").read()).hexdigest()
@@ -471,8 +671,14 @@ def upload_video():
     video_url = url_for("uploaded_file", filename=new_file_name)
     flash("Video caricato con successo!", "success")
 
+    # the browser can not play AVI: convert the video to MP4 in background
+    transcode_url = ""
+    if save_path.suffix.lower() in transcoder.TRANSCODE_EXTENSIONS:
+        ocr_service.transcode(save_path, content_md5=file_content_md5)
+        transcode_url = url_for("transcode_status", filename=new_file_name)
+
     # check date time
-    data = camtrap_banner_decoder.extract_date_time(save_path)
+    data, camtrap_id, reasons = decode_banner(save_path, session["username"])
     if "error" not in data:
         print(f"{data=}")
         code: str = ""
@@ -484,41 +690,78 @@ def upload_video():
             time_ = data["time"][:2] + ":" + data["time"][2:4] + ":" + data["time"][4:6]
         except Exception:
             time_ = data["time"]
+        date = data["date"]
     else:
         code = ""
+        date = ""
         time_ = ""
+    if reasons:
+        flash(f"Data e ora da verificare: {', '.join(reasons)}", "warning")
 
     print(session["fullname"])
 
     # list of fototrappole
-    with engine.connect() as conn:
-        fototrappole = (
-            conn.execute(
-                text("SELECT codice FROM fototrappole WHERE operator = :operator"),
-                {"operator": session["username"]},
-            )
-            .mappings()
-            .all()
-        )
+    fototrappole = reference_cache.get_operator_fototrappole(
+        engine, session["username"]
+    )
 
     return render_template(
         "upload_info.html",
         original_file_name=original_file_name,
         new_file_name=str(new_file_name),
         video_url=video_url,
+        transcode_url=transcode_url,
         operator=session["fullname"],
         code=code,
-        date=data["date"],
+        date=date,
         time_=time_,
         file_content_md5=file_content_md5,
+        camtrap_id=camtrap_id,
         fototrappole=fototrappole,
+        fototrappola_details=Markup(
+            fototrappola_details(reference_cache.get_fototrappola(engine, camtrap_id))
+            if camtrap_id
+            else ""
+        ),
     )
 
 
-@app.route(APP_ROOT + "/uploads/<filename>")
+@app.route(APP_ROOT + "/uploads/<path:filename>")
 @login_required
 def uploaded_file(filename):
-    return send_from_directory(app.config["UPLOAD_FOLDER"], filename)
+    return media_serving.send_media(
+        app.config["UPLOAD_FOLDER"],
+        filename,
+        accel=app.config["MEDIA_ACCEL"],
+        accel_prefix=app.config["MEDIA_ACCEL_PREFIX"],
+    )
+
+
+@app.route(APP_ROOT + "/transcode_status/<path:filename>")
+@login_required
+def transcode_status(filename):
+    """
+    htmx fragment with the progress of the conversion to MP4 (the video when done)
+    """
+    job = ocr_service.transcode_progress(Path(app.config["UPLOAD_FOLDER"]) / filename)
+    if job is None:
+        return "Video non trovato"
+    if job["state"] == "error":
+        return f"Errore durante la conversione del video: {escape(job['error'])}"
+    if job["state"] == "done":
+        mp4_url = url_for(
+            "uploaded_file",
+            filename=storage.relative_path(app.config["UPLOAD_FOLDER"], job["output"]),
+        )
+        return (
+            f'<video id="video_camtrap" src="{mp4_url}" width="720" '
+            'preload="metadata" controls></video>'
+        )
+    return (
+        f'<div hx-get="{url_for("transcode_status", filename=filename)}" '
+        'hx-trigger="every 2s" hx-swap="outerHTML">'
+        f"Conversione del video in MP4: {int(job['progress'] * 100)}%</div>"
+    )
 
 
 @app.route(APP_ROOT + "/view/<int:sighting_id>")